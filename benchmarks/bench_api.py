@@ -0,0 +1,117 @@
+"""Latency and throughput of the API hot paths
+
+Seeds a database with `--users` users and `--transactions` transactions and
+drives the app in process (httpx ASGI transport), reporting p50/p90/p99 and
+requests/s per endpoint. Results are saved as JSON on benchmarks/results/,
+pass `--compare` with a previous file to see the change.
+
+    python -m benchmarks.bench_api --users 1000 --transactions 100000
+    python -m benchmarks.bench_api --compare benchmarks/results/api-....json
+
+Uses a throwaway sqlite file by default, pass `--uri` to use another database
+(all dundie tables are dropped and recreated!).
+"""
+import argparse
+import asyncio
+import json
+import random
+from pathlib import Path
+
+from benchmarks.harness import LoadDriver, compare, save_results, seed, use_database
+
+
+def scenarios(users: int, auth: dict, user_auth: dict) -> dict:
+    """name -> (make_request, share of --requests)"""
+    def username(i):
+        return f"user-{random.Random(i).randint(2, users)}"
+
+    return {
+        "POST /token": (
+            lambda client, i: client.post(
+                "/token", data={"username": username(i), "password": "bench"}
+            ),
+            0.1,  # bcrypt bound, a few are enough
+        ),
+        "GET /user/": (
+            lambda client, i: client.get("/user/", headers=auth),
+            1,
+        ),
+        "GET /user/{username}/?show_balance=true": (
+            lambda client, i: client.get(
+                f"/user/{username(i)}/?show_balance=true", headers=auth
+            ),
+            1,
+        ),
+        "POST /transaction/{username}/": (
+            lambda client, i: client.post(
+                f"/transaction/{username(i)}/", json={"value": 1}, headers=auth
+            ),
+            1,
+        ),
+        "GET /transaction/": (
+            lambda client, i: client.get("/transaction/", headers=user_auth),
+            1,
+        ),
+    }
+
+
+async def run(args) -> dict:
+    from dundie.app import app
+
+    driver = LoadDriver(app)
+    try:
+        auth = await driver.login("admin")
+        user_auth = await driver.login("user-2")
+        results = {}
+        for name, (make_request, share) in scenarios(args.users, auth, user_auth).items():
+            if args.only and args.only not in name:
+                continue
+            requests = max(1, int(args.requests * share))
+            results[name] = await driver.run(
+                make_request, requests, args.concurrency, warmup=min(5, requests)
+            )
+            print(
+                f"{name:<42}{results[name]['p50_ms']:>10.2f}{results[name]['p99_ms']:>10.2f}"
+                f"{results[name]['throughput_rps']:>10.1f}{results[name]['errors']:>8}"
+            )
+        return results
+    finally:
+        await driver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default="sqlite:////tmp/dundie_bench_api.db")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", help="Only endpoints containing this text")
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the seeded database")
+    parser.add_argument("--output", type=Path, help="JSON file [benchmarks/results/...]")
+    parser.add_argument("--compare", type=Path, help="Previous JSON results")
+    args = parser.parse_args()
+
+    use_database(args.uri)
+    if not args.no_seed:
+        print(f"seeding {args.users} users and {args.transactions} transactions...")
+        seed(args.uri, args.users, args.transactions)
+
+    print(f"{'endpoint':<42}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    results = asyncio.run(run(args))
+    params = {
+        k: v
+        for k, v in vars(args).items()
+        if k in ("users", "transactions", "requests", "concurrency")
+    }
+    print(f"saved {save_results(results, params, args.output)}")
+
+    if args.compare:
+        print(f"{'endpoint':<42}{'metric':>16}{'before':>10}{'after':>10}{'change':>9}")
+        baseline = json.loads(args.compare.read_text())
+        for name, metric, before, after, change in compare(baseline, results):
+            print(f"{name:<42}{metric:>16}{before:>10}{after:>10}{change:>8}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Lookup speedup of the hot column indexes (migration 9c1f3a2b7d4e)
+
+Seeds a database with `--users` users and `--transactions` transactions,
+times the hot lookups without the indexes, creates them and times again.
+
+    python -m benchmarks.bench_indexes --users 100000 --transactions 10000000
+
+Uses a throwaway sqlite file by default, pass `--uri` to use another database
+(all dundie tables are dropped and recreated!).
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select, text
+
+from dundie.models import SQLModel, Transaction, User
+
+CHUNK_SIZE = 50_000
+INDEXES = [
+    *User.__table__.indexes,
+    *Transaction.__table__.indexes,
+]
+
+
+def seed(engine, users: int, transactions: int):
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    for index in INDEXES:
+        index.drop(engine)
+
+    with engine.begin() as conn:
+        for start in range(1, users + 1, CHUNK_SIZE):
+            conn.execute(
+                insert(User.__table__),
+                [
+                    {
+                        "id": i,
+                        "username": f"user-{i}",
+                        "email": f"user-{i}@dm.com",
+                        "password": "not-a-hash",
+                        "name": f"User {i}",
+                        "dept": "sales",
+                        "currency": "USD",
+                    }
+                    for i in range(start, min(start + CHUNK_SIZE, users + 1))
+                ],
+            )
+
+    epoch = datetime(2020, 1, 1)
+    rand = random.Random(42)
+    with engine.begin() as conn:
+        for start in range(0, transactions, CHUNK_SIZE):
+            conn.execute(
+                insert(Transaction.__table__),
+                [
+                    {
+                        "user_id": rand.randint(1, users),
+                        "from_id": rand.randint(1, users),
+                        "value": rand.randint(1, 100),
+                        "date": epoch + timedelta(minutes=i),
+                    }
+                    for i in range(start, min(start + CHUNK_SIZE, transactions))
+                ],
+            )
+
+
+def lookups(users: int):
+    """The queries issued by the API hot paths"""
+    user_id = random.randint(1, users)
+    return {
+        "user by username": select(User.id).where(User.username == f"user-{user_id}"),
+        "user by email": select(User.id).where(User.email == f"user-{user_id}@dm.com"),
+        "incomes by date": select(Transaction.id)
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.date.desc())
+        .limit(50),
+        "expenses by date": select(Transaction.id)
+        .where(Transaction.from_id == user_id)
+        .order_by(Transaction.date.desc())
+        .limit(50),
+    }
+
+
+def measure(engine, users: int, repeat: int) -> dict:
+    timings: dict[str, list[float]] = {}
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            for name, query in lookups(users).items():
+                start = time.perf_counter()
+                conn.execute(query).all()
+                timings.setdefault(name, []).append(time.perf_counter() - start)
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default="sqlite:////tmp/dundie_bench_indexes.db")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--transactions", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.uri)
+    print(f"seeding {args.users} users and {args.transactions} transactions...")
+    seed(engine, args.users, args.transactions)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE"))
+
+    without = measure(engine, args.users, args.repeat)
+    for index in INDEXES:
+        index.create(engine)
+    with_indexes = measure(engine, args.users, args.repeat)
+
+    print(f"{'lookup':<20}{'no index (ms)':>15}{'indexed (ms)':>15}{'speedup':>10}")
+    for name in without:
+        before, after = without[name] * 1000, with_indexes[name] * 1000
+        print(f"{name:<20}{before:>15.3f}{after:>15.3f}{before / after:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
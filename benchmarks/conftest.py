@@ -0,0 +1,67 @@
+"""pytest entry point of the benchmarks (not part of the `tests` run)
+
+    pytest benchmarks/ -p no:cacheprovider
+    BENCH_USERS=10000 BENCH_TRANSACTIONS=1000000 pytest benchmarks/
+
+Scale comes from the BENCH_* environment variables, results of the session
+are saved as JSON on benchmarks/results/ (or BENCH_OUTPUT).
+"""
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+from benchmarks.harness import LoadDriver, save_results, seed, use_database
+
+PARAMS = {
+    "uri": os.getenv("BENCH_URI", "sqlite:////tmp/dundie_bench_api.db"),
+    "users": int(os.getenv("BENCH_USERS", "1000")),
+    "transactions": int(os.getenv("BENCH_TRANSACTIONS", "100000")),
+    "requests": int(os.getenv("BENCH_REQUESTS", "200")),
+    "concurrency": int(os.getenv("BENCH_CONCURRENCY", "8")),
+}
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def bench_results():
+    results = {}
+    yield results
+    if results:
+        output = os.getenv("BENCH_OUTPUT")
+        params = {k: v for k, v in PARAMS.items() if k != "uri"}
+        print(f"\nsaved {save_results(results, params, Path(output) if output else None)}")
+
+
+@pytest.fixture(scope="session")
+def driver(loop):
+    use_database(PARAMS["uri"])
+    seed(PARAMS["uri"], PARAMS["users"], PARAMS["transactions"])
+    from dundie.app import app
+
+    driver = LoadDriver(app)
+    driver.auth = loop.run_until_complete(driver.login("admin"))
+    driver.user_auth = loop.run_until_complete(driver.login("user-2"))
+    yield driver
+    loop.run_until_complete(driver.close())
+
+
+@pytest.fixture
+def bench(loop, driver, bench_results):
+    """bench(name, make_request, share) runs and records a scenario"""
+    def run(name, make_request, share=1):
+        requests = max(1, int(PARAMS["requests"] * share))
+        result = loop.run_until_complete(
+            driver.run(make_request, requests, PARAMS["concurrency"], warmup=min(5, requests))
+        )
+        bench_results[name] = result
+        return result
+
+    return run
@@ -0,0 +1,208 @@
+"""Benchmark helpers: database seeding, an in-process ASGI load driver,
+latency stats and JSON results.
+
+The app is imported lazily, after `use_database` pointed the settings to the
+benchmark database.
+"""
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+CHUNK_SIZE = 50_000
+PASSWORD = "bench"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def use_database(uri: str):
+    """Points the dundie settings to `uri`, call it before importing dundie.app"""
+    os.environ["DUNDIE_DB__uri"] = uri
+    os.environ.setdefault("DUNDIE_SECURITY__SECRET_KEY", "benchmark")
+    os.environ.setdefault("DUNDIE_EMAIL__outbox_in_app", "false")
+
+
+def seed(uri: str, users: int, transactions: int, seed_value: int = 42):
+    """Recreates the tables with `users` users (user-1 is the superuser
+    `admin`) and `transactions` random transactions between them, with
+    matching balances and ledger summary. Every password is `PASSWORD`.
+    """
+    from sqlalchemy import create_engine, insert
+    from sqlmodel import Session
+
+    from dundie.models import Balance, SQLModel, Transaction, User
+    from dundie.security import get_password_hash
+    from dundie.tasks.transaction import rebuild_ledger_summary
+
+    engine = create_engine(uri)
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+
+    rand = random.Random(seed_value)
+    hashed = get_password_hash(PASSWORD)  # bcrypt once, shared by all users
+    with engine.begin() as conn:
+        for start in range(1, users + 1, CHUNK_SIZE):
+            conn.execute(
+                insert(User.__table__),
+                [
+                    {
+                        "id": i,
+                        "username": "admin" if i == 1 else f"user-{i}",
+                        "email": f"user-{i}@dm.com",
+                        "password": hashed,
+                        "name": f"User {i}",
+                        "dept": "management" if i == 1 else rand.choice(["sales", "it"]),
+                        "currency": "USD",
+                    }
+                    for i in range(start, min(start + CHUNK_SIZE, users + 1))
+                ],
+            )
+
+    balances: dict[int, int] = defaultdict(int)
+    epoch = datetime.utcnow() - timedelta(minutes=transactions)
+    with engine.begin() as conn:
+        for start in range(0, transactions, CHUNK_SIZE):
+            rows = []
+            for i in range(start, min(start + CHUNK_SIZE, transactions)):
+                row = {
+                    "user_id": rand.randint(2, users),
+                    "from_id": 1,  # admin funds every account
+                    "value": rand.randint(1, 100),
+                    "date": epoch + timedelta(minutes=i),
+                }
+                balances[row["user_id"]] += row["value"]
+                balances[1] -= row["value"]
+                rows.append(row)
+            conn.execute(insert(Transaction.__table__), rows)
+        items = [
+            {"user_id": user_id, "value": value, "updated_at": datetime.utcnow()}
+            for user_id, value in balances.items()
+        ]
+        for start in range(0, len(items), CHUNK_SIZE):
+            conn.execute(insert(Balance.__table__), items[start:start + CHUNK_SIZE])
+
+    with Session(engine) as session:
+        rebuild_ledger_summary(session)
+    engine.dispose()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """p50/p90/p99 (ms) and throughput (requests/s) of a run"""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+
+
+class LoadDriver:
+    """Sends requests to the ASGI app in process (no sockets, no server).
+
+    `run` keeps `concurrency` requests in flight until `requests` were sent,
+    each one built by `make_request(client, i)` (a coroutine returning the
+    httpx response).
+    """
+
+    def __init__(self, app, base_url: str = "http://bench"):
+        import httpx
+
+        self.client = httpx.AsyncClient(app=app, base_url=base_url, timeout=60)
+
+    async def login(self, username: str, password: str = PASSWORD) -> dict:
+        response = await self.client.post(
+            "/token", data={"username": username, "password": password}
+        )
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def run(
+        self,
+        make_request: Callable[..., Awaitable],
+        requests: int,
+        concurrency: int = 1,
+        warmup: int = 0,
+    ) -> dict:
+        for i in range(warmup):
+            await make_request(self.client, i)
+
+        latencies: list[float] = []
+        errors = 0
+        counter = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                start = time.perf_counter()
+                response = await make_request(self.client, i)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code >= 400
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(latencies, time.perf_counter() - start, errors)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results: dict, params: dict, path: Optional[Path] = None) -> Path:
+    """Writes the results with run metadata, by default on benchmarks/results/"""
+    if path is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        path = RESULTS_DIR / f"api-{stamp}-{git_revision() or 'nogit'}.json"
+    path.write_text(
+        json.dumps(
+            {
+                "revision": git_revision(),
+                "date": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "params": params,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    return path
+
+
+def compare(baseline: dict, results: dict) -> list[tuple]:
+    """Rows of (name, metric, baseline, current, change %) shared by both runs"""
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p99_ms", "throughput_rps"):
+            if previous.get(metric) and current.get(metric) is not None:
+                change = (current[metric] - previous[metric]) / previous[metric] * 100
+                rows.append((name, metric, previous[metric], current[metric], round(change, 1)))
+    return rows
@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks.bench_api import scenarios
+from benchmarks.conftest import PARAMS
+
+NAMES = list(scenarios(PARAMS["users"], {}, {}))
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_endpoint(name, driver, bench):
+    make_request, share = scenarios(PARAMS["users"], driver.auth, driver.user_auth)[name]
+    result = bench(name, make_request, share)
+    assert result["errors"] == 0
+    print(f"\n{name}: p50 {result['p50_ms']}ms p99 {result['p99_ms']}ms "
+          f"{result['throughput_rps']} req/s")
@@ -1,5 +1,26 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import time
+
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from dundie.auth import get_current_user
+from dundie.config import settings
+from dundie.db import QueryStats, get_async_session_maker, query_stats
+from dundie.metrics import (
+    HTTP_IN_FLIGHT,
+    mark_process_dead,
+    observe_request,
+    refresh_pool_gauges,
+)
+from dundie.profiler import SamplingProfiler
 from dundie.routes import main_router
+from dundie.routes.leaderboard import load_ranking
+from dundie.routes.profiler import profile_response
+from dundie.security import PasswordHasherBusy, pwd_hasher
+from dundie.tasks.email import OutboxWorker
 
 
 app = FastAPI(
@@ -9,3 +30,141 @@ app = FastAPI(
 )
 
 app.include_router(main_router)
+
+logger = logging.getLogger("dundie.requests")
+
+# Superusers get the profile of a request sending this header (see request_profiler)
+PROFILE_HEADER = "X-Dundie-Profile"
+
+
+def route_template(request: Request) -> str:
+    """Path of the matched route (`/user/{username}/`), keeps labels bounded"""
+    route = request.scope.get("route")
+    return route.path if route else "unmatched"
+
+
+@app.middleware("http")
+async def instrumentation(request: Request, call_next):
+    """Counts the queries, DB time and sessions of each request and feeds
+    the Prometheus request metrics (labeled by route template), unhandled
+    exceptions are counted as 500.
+    """
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        observe_request(
+            request.method, route_template(request), 500, time.perf_counter() - start
+        )
+        raise
+    finally:
+        query_stats.reset(token)
+        HTTP_IN_FLIGHT.dec()
+    duration = time.perf_counter() - start
+    observe_request(request.method, route_template(request), response.status_code, duration)
+    refresh_pool_gauges()
+    if settings.db.server_timing:
+        response.headers["Server-Timing"] = (
+            f"{stats.server_timing()}, app;dur={duration * 1000:.2f}"
+        )
+    logger.info(
+        "%s %s %s %d queries %.1fms db",
+        request.method,
+        request.url.path,
+        response.status_code,
+        stats.queries,
+        stats.db_time * 1000,
+        extra={
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "db_queries": stats.queries,
+            "db_time_ms": round(stats.db_time * 1000, 2),
+            "db_sessions": stats.sessions,
+        },
+    )
+    return response
+
+
+@app.middleware("http")
+async def request_profiler(request: Request, call_next):
+    """Superusers sending `X-Dundie-Profile: speedscope|collapsed` get the
+    sampled profile of the request instead of its response (its status is
+    on `X-Profile-Status`). Requests served by the worker at the same time
+    show up on the profile too.
+    """
+    format = request.headers.get(PROFILE_HEADER)
+    if not format:
+        return await call_next(request)
+    if format not in ("speedscope", "collapsed"):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"detail": f"{PROFILE_HEADER} must be speedscope or collapsed"},
+        )
+    try:
+        user = await run_in_threadpool(get_current_user, "", request)
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code, content={"detail": e.detail}, headers=e.headers
+        )
+    if not user.superuser:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN, content={"detail": "Not a super user"}
+        )
+
+    profiler = SamplingProfiler(interval=settings.profiler.interval_ms / 1000)
+    profiler.start(settings.profiler.max_seconds)
+    try:
+        response = await call_next(request)
+        async for _ in response.body_iterator:  # streaming the body is part of the request
+            pass
+    finally:
+        profiler.stop()
+    return profile_response(profiler, format, {"X-Profile-Status": str(response.status_code)})
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    """Login storms are answered with 503 instead of queueing forever"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    pwd_hasher.shutdown()
+
+
+@app.on_event("shutdown")
+def drop_live_metrics():
+    mark_process_dead()
+
+
+@app.on_event("startup")
+async def warm_up_leaderboard():
+    async with get_async_session_maker()() as session:
+        await load_ranking(session)
+
+
+@app.on_event("startup")
+async def start_email_worker():
+    """Delivers the email outbox from this process (see `dundie email-worker`)"""
+    if settings.email.outbox_in_app:
+        app.state.email_worker_stop = asyncio.Event()
+        app.state.email_worker = asyncio.create_task(
+            OutboxWorker().run_async(stop=app.state.email_worker_stop)
+        )
+
+
+@app.on_event("shutdown")
+async def stop_email_worker():
+    if getattr(app.state, "email_worker", None) is not None:
+        app.state.email_worker_stop.set()
+        await app.state.email_worker
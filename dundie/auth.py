@@ -1,4 +1,8 @@
 """Token based auth"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Callable, Optional, Union
 from functools import partial
@@ -8,14 +12,17 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
 from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
 
 from dundie.config import settings
-from dundie.db import engine
+from dundie.db import get_engine
+from dundie.metrics import CACHE_LOOKUPS
 from dundie.models.user import User
-from dundie.security import verify_password
+from dundie.security import password_fingerprint, verify_password, verify_password_async
 
 SECRET_KEY = settings.security.secret_key  
 ALGORITHM = settings.security.algorithm  
+TOKEN_CACHE_SIZE = settings.security.token_cache_size
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -49,6 +56,8 @@ def create_access_token(
     """Creates a JWT Token from user data
 
     scope: access_token or refresh_token
+    data must have the `pwd` claim (password_fingerprint of the user
+    password), tokens without it or issued for an old password are rejected.
     """
     to_encode = data.copy()
     if expires_delta:
@@ -79,37 +88,170 @@ def authenticate_user(
     return user
 
 
+async def authenticate_user_async(
+    get_user: Callable, username: str, password: str
+) -> Union[User, bool]:
+    """Authenticate the user verifying the password on the hasher pool.
+
+    `get_user` is sync (a DB query), it runs on the threadpool.
+    """
+    user = await run_in_threadpool(get_user, username)
+    if not user:
+        return False
+    if not await verify_password_async(password, user.password):
+        return False
+    return user
+
+
 def get_user(username) -> Optional[User]:
     """Get user from database"""
     query = select(User).where(User.username == username)
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         return session.exec(query).first()
 
 
+class TokenCache:
+    """Process wide LRU cache of validated JWT claims.
+
+    Entries are keyed by the sha256 of the token and served until the
+    token `exp`, so a cached token is never accepted after it expires.
+    Use `invalidate_user` to evict every cached token of a user
+    (e.g: after a password change). Evicting only frees the memory, the
+    token is revoked by `get_current_user` checking its `pwd` claim.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._by_user: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def decode(self, token: str) -> dict:
+        """Returns the claims of `token`, decoding and validating it on a miss"""
+        if self.maxsize <= 0:
+            return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+        key = self._key(token)
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None:
+                claims, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    CACHE_LOOKUPS.labels("token", "hit").inc()
+                    return claims
+                self._evict(key)
+
+        CACHE_LOOKUPS.labels("token", "miss").inc()
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if "exp" in claims:
+            self._store(key, claims, float(claims["exp"]))
+        return claims
+
+    def _store(self, key: str, claims: dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            if (username := claims.get("sub")) is not None:
+                self._by_user.setdefault(username, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: str):
+        """Removes `key`, must be called holding the lock"""
+        claims, _ = self._entries.pop(key)
+        username = claims.get("sub")
+        if (keys := self._by_user.get(username)) is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[username]
+
+    def invalidate_token(self, token: str):
+        """Evicts a single token"""
+        key = self._key(token)
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def invalidate_user(self, username: str):
+        """Evicts all cached tokens of `username`"""
+        with self._lock:
+            for key in list(self._by_user.get(username, ())):
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
+
+
+class IdentityCache:
+    """Request scoped cache of decoded tokens and loaded users.
+
+    Lives in `request.state` so every dependency resolved for the same
+    request decodes a given token and loads a given user only once.
+    """
+
+    def __init__(self):
+        self.payloads: dict[str, dict] = {}
+        self.users: dict[str, Optional[User]] = {}
+
+    def decode(self, token: str) -> dict:
+        if token not in self.payloads:
+            self.payloads[token] = token_cache.decode(token)
+        return self.payloads[token]
+
+    def get_user(self, username: str) -> Optional[User]:
+        if username not in self.users:
+            self.users[username] = get_user(username)
+        return self.users[username]
+
+
+def get_identity_cache(request: Optional[Request] = None) -> IdentityCache:
+    """Returns the IdentityCache bound to the request (a new one if no request)"""
+    if request is None:
+        return IdentityCache()
+    cache = getattr(request.state, "identity_cache", None)
+    if cache is None:
+        cache = IdentityCache()
+        request.state.identity_cache = cache
+    return cache
+
+
 def get_current_user(
     token: str = Depends(oauth2_scheme),
     request: Request = None,  
     fresh=False
 ) -> User:
-    """Get current user authenticated"""
+    """Get current user authenticated
+
+    When `token` is empty it is taken from the request Authorization header.
+    Tokens issued before the last password change of the user are rejected.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    if request:
+    if request and not token:
         if authorization := request.headers.get("authorization"):
             try:
                 token = authorization.split(" ")[1]
             except IndexError:
                 raise credentials_exception
 
+    identity_cache = get_identity_cache(request)
     try:
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,  
-            algorithms=[ALGORITHM]  
-        )
+        payload = identity_cache.decode(token)
         username: str = payload.get("sub")  
 
         if username is None:
@@ -117,8 +259,8 @@ def get_current_user(
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(username=token_data.username)
-    if user is None:
+    user = identity_cache.get_user(token_data.username)
+    if user is None or payload.get("pwd") != password_fingerprint(user.password):
         raise credentials_exception
     if fresh and (not payload["fresh"] and not user.superuser):
         raise credentials_exception
@@ -154,11 +296,11 @@ AuthenticatedSuperUser = Depends(get_current_super_user)
 
 async def validate_token(token: str = Depends(oauth2_scheme)) -> User:
     """Validates user token"""
-    user = get_current_user(token=token)
+    user = await run_in_threadpool(get_current_user, token)
     return user
 
 
-async def get_user_if_change_password_is_allowed(
+def get_user_if_change_password_is_allowed(
     *,
     request: Request,
     pwd_reset_token: Optional[str] = None,  # from path?pwd_reset_token=xxxx
@@ -168,13 +310,18 @@ async def get_user_if_change_password_is_allowed(
     1. There is a pwd_reset_token passed as query parameter and it is valid OR
     2. authenticated_user is supersuser OR
     3. authenticated_user is User
+
+    A sync dependency (it queries the db): FastAPI runs it on the threadpool.
     """
-    target_user = get_user(username)  # The user we want to change the password
+    identity_cache = get_identity_cache(request)
+    target_user = identity_cache.get_user(username)  # The user we want to change the password
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     try:
-        valid_pwd_reset_token = get_current_user(token=pwd_reset_token or "") == target_user
+        valid_pwd_reset_token = bool(pwd_reset_token) and get_current_user(
+            token=pwd_reset_token, request=request
+        ) == target_user
     except HTTPException:
         valid_pwd_reset_token = False
 
@@ -201,7 +348,7 @@ async def get_user_if_change_password_is_allowed(
 CanChangeUserPassword = Depends(get_user_if_change_password_is_allowed)
 
 
-async def show_balance_field(
+def show_balance_field(
     *,
     request: Request,
     show_balance: Optional[bool] = False,  # from /user/?show_balance=true
@@ -210,6 +357,8 @@ async def show_balance_field(
     1. show_balance is True AND
     2. authenticated_user.superuser OR
     3. authenticated_user.username == username
+
+    A sync dependency (it queries the db): FastAPI runs it on the threadpool.
     """
     if not show_balance:
         return False
@@ -1,20 +1,32 @@
+"""Dundie CLI
+
+Commands import what they need when they run so `dundie --help` and cron
+jobs don't pay for the whole web stack, see tests/test_cli.py budgets.
+"""
+import time
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
 import typer
-from rich.console import Console
-from rich.table import Table
-from sqlmodel import Session, select
 
-from .config import settings
-from .db import engine, SQLModel
-from .models import User
-from .models.user import generate_username
-from .models.transaction import Transaction, Balance
-from .tasks.transaction import add_transaction
+# Rows fetched per round trip by streaming commands
+USER_LIST_BATCH_SIZE = 1000
 
 main = typer.Typer(name="Dundie CLI", add_completion=False)
 
 @main.command()
 def shell():
     """Shell interativo"""
+    from sqlmodel import Session, select
+
+    from .config import settings
+    from .db import get_engine
+    from .models import Balance, Transaction, User
+    from .tasks.transaction import add_transaction
+
+    engine = get_engine()
     _vars = {
         "settings": settings,
         "engine": engine,
@@ -38,23 +50,65 @@ def shell():
         code.InteractiveConsole(_vars).interact()
 
 
+class UserListFormat(str, Enum):
+    table = "table"
+    csv = "csv"
+    jsonl = "jsonl"
+
+
 @main.command()
-def user_list():
+def user_list(
+    format: UserListFormat = typer.Option(
+        UserListFormat.table, "--format", help="csv and jsonl are streamed"
+    ),
+    dept: Optional[str] = typer.Option(None, help="Only users of this dept"),
+    limit: Optional[int] = typer.Option(None, min=1, help="Max number of users"),
+):
     """Lists all users"""
-    table = Table(title="dundie users")
+    import csv
+    import json
+    import sys
+
+    from sqlalchemy import func
+    from sqlmodel import Session, select
+
+    from .db import get_engine
+    from .models import Balance, User
+
     fields = ["name", "username", "dept", "email", "currency"]
-    for header in fields:
-        table.add_column(header, style="magenta")
-    table.add_column("Balance", style="magenta")
+    # balances in the same statement, rows fetched from a server side cursor
+    query = (
+        select(*(getattr(User, field) for field in fields))
+        .add_columns(func.coalesce(Balance.value, 0).label("balance"))
+        .outerjoin(Balance, Balance.user_id == User.id)
+        .order_by(User.id)
+        .execution_options(yield_per=USER_LIST_BATCH_SIZE)
+    )
+    if dept:
+        query = query.where(User.dept == dept)
+    if limit:
+        query = query.limit(limit)
 
-    with Session(engine) as session:
-        users = session.exec(select(User))
-        for user in users:
-            model_attrs = [getattr(user, field) for field in fields]
-            model_attrs.append(str(user.balance))
-            table.add_row(*model_attrs)
+    with Session(get_engine()) as session:
+        rows = session.execute(query)
+        if format == UserListFormat.csv:
+            writer = csv.writer(sys.stdout)
+            writer.writerow([*fields, "balance"])
+            writer.writerows(rows)
+        elif format == UserListFormat.jsonl:
+            for row in rows:
+                sys.stdout.write(json.dumps(dict(row._mapping)) + "\n")
+        else:
+            from rich.console import Console
+            from rich.table import Table
 
-    Console().print(table)
+            table = Table(title="dundie users")
+            for header in fields:
+                table.add_column(header, style="magenta")
+            table.add_column("Balance", style="magenta")
+            for row in rows:
+                table.add_row(*(str(value) for value in row))
+            Console().print(table)
 
 
 @main.command()
@@ -63,11 +117,17 @@ def create_user(
     email: str,
     password: str,
     dept: str,
-    username: str | None = None,
+    username: Optional[str] = None,
     currency: str = "USD",
 ):
     """Create user"""
-    with Session(engine) as session:
+    from sqlmodel import Session
+
+    from .db import get_engine
+    from .models import User
+    from .models.user import generate_username
+
+    with Session(get_engine()) as session:
         user = User(
             name=name,
             email=email,
@@ -83,18 +143,60 @@ def create_user(
         return user
 
 
+@main.command()
+def import_users(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help=".csv or .jsonl file"),
+    processes: Optional[int] = typer.Option(
+        None, min=1, help="Password hashing processes [default: security.pwd_hash_processes]"
+    ),
+):
+    """Creates the users of the file, skipping usernames already taken"""
+    from sqlmodel import Session
+
+    from .db import get_engine
+    from .tasks import user as tasks
+
+    rows = tasks.load_user_rows(path)
+    with Session(get_engine()) as session:
+        result = tasks.import_users(session, rows, processes=processes)
+
+    if result["skipped"]:
+        from rich.console import Console
+        from rich.table import Table
+
+        table = Table(title=f"{len(result['skipped'])} skipped")
+        for head in ["item", "username", "error"]:
+            table.add_column(head, style="magenta")
+        for error in result["skipped"]:
+            table.add_row(str(error["index"] + 1), str(error["username"] or ""), error["error"])
+        Console().print(table)
+
+    typer.echo(
+        f"imported {result['created']} users in {result['seconds']:.2f}s "
+        f"({result['per_second']} users/s, {result['hash_seconds']:.2f}s hashing)"
+    )
+
+
 @main.command()
 def transaction(
     username: str,
     value: int
 ):
     """Adds specified avlue from admin to user"""
+    from rich.console import Console
+    from rich.table import Table
+    from sqlmodel import Session, select
+
+    from .db import get_engine
+    from .models import User
+    from .tasks.transaction import TransactionError, add_transaction
+
     table = Table(title="Transaction")
     fields = ["user", "before", "after"]
     for head in fields:
         table.add_column(head, style="magenta")
     
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         from_user = session.exec(select(User).where(User.username == "admin")).first()
         if not from_user:
             typer.echo("admin user not found")
@@ -106,13 +208,174 @@ def transaction(
         
         from_user_before = from_user.balance
         user_before = user.balance
-        add_transaction(user=user, from_user=from_user, session=session, value=value)
+        try:
+            add_transaction(user=user, from_user=from_user, session=session, value=value)
+        except TransactionError as e:
+            typer.echo(str(e))
+            exit(1)
         table.add_row(from_user.username, str(from_user_before), str(from_user.balance))
         table.add_row(user.username, str(user_before), str(user.balance))
 
         Console().print(table)
         
 
+@main.command()
+def transaction_batch(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help=".csv or .jsonl file"),
+    from_user: str = typer.Option("admin", help="Username sending the points"),
+):
+    """Adds transactions for each username,value of the file (all or nothing)"""
+    from sqlmodel import Session, select
+
+    from .db import get_engine
+    from .models import User
+    from .tasks.transaction import (
+        add_transactions_batch,
+        load_transaction_items,
+        TransactionBatchError,
+    )
+
+    with Session(get_engine()) as session:
+        sender = session.exec(select(User).where(User.username == from_user)).first()
+        if not sender:
+            typer.echo(f"user {from_user} not found")
+            exit(1)
+
+        try:
+            items = load_transaction_items(path)
+            start = time.perf_counter()
+            result = add_transactions_batch(items=items, from_user=sender, session=session)
+        except TransactionBatchError as e:
+            from rich.console import Console
+            from rich.table import Table
+
+            table = Table(title=str(e))
+            for head in ["item", "username", "error"]:
+                table.add_column(head, style="magenta")
+            for error in e.errors:
+                item = "" if error["index"] is None else str(error["index"] + 1)
+                table.add_row(item, str(error["username"] or ""), error["error"])
+            Console().print(table)
+            exit(1)
+        elapsed = time.perf_counter() - start
+
+    typer.echo(
+        f"added {result['count']} transactions ({result['total']} points) "
+        f"from {from_user} in {elapsed:.2f}s"
+    )
+
+
+@main.command(name="reconcile-balances")
+def reconcile_balances_cmd(
+    fix: bool = typer.Option(
+        False, "--fix", help="Overwrite drifted balances with ledger values"
+    )
+):
+    """Recomputes balances from the ledger and reports drift"""
+    from rich.console import Console
+    from rich.table import Table
+    from sqlmodel import Session, select
+
+    from .db import get_engine
+    from .models import User
+    from .tasks.transaction import reconcile_balances
+
+    with Session(get_engine()) as session:
+        drifts = reconcile_balances(session, fix=fix)
+        if not drifts:
+            typer.echo("all balances match the ledger")
+            return
+
+        usernames = dict(
+            session.exec(
+                select(User.id, User.username).where(
+                    User.id.in_([drift["user_id"] for drift in drifts])
+                )
+            ).all()
+        )
+
+    table = Table(title="Balance drift")
+    fields = ["user", "balance", "ledger", "drift"]
+    for head in fields:
+        table.add_column(head, style="magenta")
+    for drift in drifts:
+        table.add_row(
+            usernames.get(drift["user_id"], str(drift["user_id"])),
+            str(drift["balance"]),
+            str(drift["ledger"]),
+            str(drift["balance"] - drift["ledger"]),
+        )
+    Console().print(table)
+    if fix:
+        typer.echo(f"fixed {len(drifts)} balance(s)")
+
+
+@main.command(name="rebuild-ledger-summary")
+def rebuild_ledger_summary_cmd():
+    """Recomputes the daily ledger summary (stats, leaderboard) from transactions"""
+    from sqlmodel import Session
+
+    from .db import get_engine
+    from .tasks.transaction import rebuild_ledger_summary
+
+    start = time.perf_counter()
+    with Session(get_engine()) as session:
+        rows = rebuild_ledger_summary(session)
+    typer.echo(f"rebuilt {rows} ledger summary rows in {time.perf_counter() - start:.2f}s")
+
+
+@main.command(name="archive-ledger")
+def archive_ledger_cmd(
+    days: Optional[int] = typer.Option(
+        None,
+        help="Archive transactions older than this number of days "
+        "[default: ledger.archive_after_days]",
+    )
+):
+    """Moves old transactions to the archive keeping opening balances"""
+    from sqlmodel import Session
+
+    from .config import settings
+    from .db import get_engine
+    from .tasks.transaction import archive_ledger
+
+    if days is None:
+        days = settings.ledger.archive_after_days
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    before = today - timedelta(days=days)
+    start = time.perf_counter()
+    with Session(get_engine()) as session:
+        result = archive_ledger(session, before)
+    typer.echo(
+        f"archived {result['transactions']} transactions before {before.date()} "
+        f"({result['users']} opening balances) in {time.perf_counter() - start:.2f}s"
+    )
+
+
+@main.command()
+def email_worker(
+    once: bool = typer.Option(False, "--once", help="Send one batch and exit"),
+):
+    """Delivers the queued emails (password reset...) reusing one SMTP connection"""
+    from .tasks.email import OutboxWorker
+
+    worker = OutboxWorker()
+    if once:
+        try:
+            result = worker.run_once()
+        finally:
+            worker.sender.close()
+        typer.echo(
+            f"sent {result['sent']}, retried {result['retried']}, failed {result['failed']}"
+        )
+        return
+    typer.echo("delivering emails, Ctrl+C to stop")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+
+
 @main.command()
 def reset_db(
     force: bool = typer.Option(
@@ -120,6 +383,9 @@ def reset_db(
     )
 ):
     """Resets the database tables"""
+    from .db import get_engine
+    from .models import SQLModel
+
     force = force or typer.confirm("Are you sure?")
     if force:
-        SQLModel.metadata.drop_all(engine)
+        SQLModel.metadata.drop_all(get_engine())
@@ -12,10 +12,6 @@ settings = Dynaconf(
     environments=["development", "production", "testing"],
     env_switcher="dundie_env",
     load_dotenv=False,
-)
-
-settings.validators.register(
-    Validator("security.SECRET_KEY", must_exist=True, is_type_of=str)
-)
-
-settings.validators.validate()
\ No newline at end of file
+    # validated when the settings are first read, not on import
+    validators=[Validator("security.SECRET_KEY", must_exist=True, is_type_of=str)],
+)
\ No newline at end of file
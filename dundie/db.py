@@ -1,15 +1,278 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
 from sqlmodel import Session, create_engine, SQLModel
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session as OrmSession, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from .config import settings
-from fastapi import Depends
 
-engine = create_engine(
-    url=settings.db.uri,
-    echo=settings.db.echo,
-    connect_args=settings.db.connect_args,
-)
+# Async drivers used when `db.async_uri` is not set
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# Upper bounds (seconds) of the pool checkout wait histogram
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class PoolStats:
+    """Checkout wait time histogram and timeout counter of a connection pool.
+
+    `listeners` are called with `(seconds, timeout)` after each checkout
+    (e.g: dundie.metrics exports them to Prometheus).
+    """
+
+    def __init__(self):
+        self.listeners: list = []
+        self._lock = threading.Lock()
+        self.buckets = [0] * len(POOL_WAIT_BUCKETS)
+        self.count = 0
+        self.total_wait = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float, timeout: bool = False):
+        with self._lock:
+            self.count += 1
+            self.total_wait += seconds
+            self.timeouts += timeout
+            for i, upper in enumerate(POOL_WAIT_BUCKETS):
+                if seconds <= upper:
+                    self.buckets[i] += 1
+                    break
+        for listener in self.listeners:
+            listener(seconds, timeout)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.count,
+                "wait_seconds_total": round(self.total_wait, 6),
+                "timeouts": self.timeouts,
+                "wait_histogram": {
+                    ("+Inf" if upper == float("inf") else str(upper)): hits
+                    for upper, hits in zip(POOL_WAIT_BUCKETS, self.buckets)
+                },
+            }
+
+
+class _InstrumentedPoolMixin:
+    """Times every checkout, including waiting for a free connection"""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timeout = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timeout = True
+            raise
+        finally:
+            self.stats.observe(time.perf_counter() - start, timeout=timeout)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    stats = PoolStats()
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+
+def get_pool_options(uri: str, poolclass) -> dict:
+    """Engine pool arguments from `[db]` settings.
+
+    In memory sqlite keeps the dialect default pool (a single connection).
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.db.pool_size,
+        "max_overflow": settings.db.max_overflow,
+        "pool_timeout": settings.db.pool_timeout,
+        "pool_recycle": settings.db.pool_recycle,
+        "pool_pre_ping": settings.db.pool_pre_ping,
+    }
+
+
+def get_pool_status(engine_) -> dict:
+    """Current usage and checkout stats of an engine pool"""
+    pool = engine_.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, _InstrumentedPoolMixin):
+        status.update(pool.stats.as_dict())
+    return status
+
+
+def get_async_uri(uri: str) -> str:
+    """Returns the async driver version of a sync database uri"""
+    if settings.db.async_uri:
+        return settings.db.async_uri
+    scheme, sep, rest = uri.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+class QueryStats:
+    """Queries, DB time and sessions of a request (or a `count_queries` block)"""
+
+    def __init__(self, record: bool = False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.sessions = 0
+        self.statements: Optional[list[str]] = [] if record else None
+
+    def server_timing(self) -> str:
+        """`Server-Timing` header value"""
+        return (
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", '
+            f'db-sessions;desc="{self.sessions}"'
+        )
+
+
+# Stats of the current request, set by the app middleware
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+# Process wide trackers (count_queries), for tests where the app runs on another thread
+_trackers: list[QueryStats] = []
+
+
+def _active_stats() -> list[QueryStats]:
+    current = query_stats.get()
+    return [current, *_trackers] if current is not None else list(_trackers)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._dundie_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._dundie_query_start
+    for stats in _active_stats():
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None:
+            stats.statements.append(statement)
+
+
+@event.listens_for(OrmSession, "after_begin")  # sqlmodel and async sessions too
+def _count_session(session, transaction, connection):
+    for stats in _active_stats():
+        stats.sessions += 1
+
+
+def instrument_engine(engine_):
+    """Counts and times the queries of `engine_` on the active QueryStats"""
+    event.listen(engine_, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine_, "after_cursor_execute", _after_cursor_execute)
+    return engine_
+
+
+@contextmanager
+def count_queries(record: bool = True):
+    """Counts every query of the process (any thread) inside the block"""
+    stats = QueryStats(record=record)
+    _trackers.append(stats)
+    try:
+        yield stats
+    finally:
+        _trackers.remove(stats)
+
+
+_engines: dict = {}
+
+
+def get_engine():
+    """The sync engine, created on first use (the CLI may never need it)"""
+    if "engine" not in _engines:
+        _engines["engine"] = instrument_engine(create_engine(
+            url=settings.db.uri,
+            echo=settings.db.echo,
+            connect_args=settings.db.connect_args,
+            **get_pool_options(settings.db.uri, InstrumentedQueuePool),
+        ))
+    return _engines["engine"]
+
+
+def get_async_engine():
+    """The async engine used by the API routes, created on first use.
+
+    The API always runs async: `db.async_uri` (or the driver derived from
+    `db.uri`) selects the async driver, there is no switch back to sync
+    sessions since the routes await AsyncSession calls.
+    """
+    if "async_engine" not in _engines:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        uri = get_async_uri(settings.db.uri)
+        _engines["async_engine"] = create_async_engine(
+            uri,
+            echo=settings.db.echo,
+            connect_args=settings.db.connect_args,
+            # NullPool: connections are not shared between event loops (e.g: tests)
+            **(
+                {"poolclass": NullPool}
+                if settings.db.async_null_pool
+                else get_pool_options(uri, InstrumentedAsyncQueuePool)
+            ),
+        )
+        instrument_engine(_engines["async_engine"].sync_engine)
+    return _engines["async_engine"]
+
+
+def get_async_session_maker():
+    if "async_session_maker" not in _engines:
+        from sqlmodel.ext.asyncio.session import AsyncSession
+
+        _engines["async_session_maker"] = sessionmaker(
+            get_async_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _engines["async_session_maker"]
+
 
 def get_session():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         yield session
 
-ActiveSession = Depends(get_session)
\ No newline at end of file
+
+async def get_async_session():
+    async with get_async_session_maker()() as session:
+        yield session
+
+
+def _depends(dependency):
+    from fastapi import Depends  # the CLI doesn't need the web stack
+
+    return Depends(dependency)
+
+
+# Created on first access: `from dundie.db import engine` keeps working
+_LAZY = {
+    "engine": get_engine,
+    "async_engine": get_async_engine,
+    "async_session_maker": get_async_session_maker,
+    "ActiveSession": lambda: _depends(get_session),
+    "AsyncActiveSession": lambda: _depends(get_async_session),
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
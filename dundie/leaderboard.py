@@ -0,0 +1,201 @@
+"""Live leaderboard of top earners (by balance) per department"""
+import abc
+import bisect
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from dundie.config import settings
+from dundie.models import Balance, User
+
+
+class LeaderboardBackend(abc.ABC):
+    """Storage of the ranking, implement it to use a shared store (e.g: redis).
+
+    Entries are dicts with `user_id`, `username`, `dept` and `balance`.
+    """
+
+    @abc.abstractmethod
+    def load(self, entries: Iterable[dict]):
+        """Replaces the whole ranking"""
+
+    @abc.abstractmethod
+    def apply_deltas(self, deltas: dict[int, int]) -> bool:
+        """Adds `deltas` (user_id -> points) to the balances.
+
+        Returns False (changing nothing) if any user is unknown.
+        """
+
+    @abc.abstractmethod
+    def top(self, dept: Optional[str] = None, limit: int = 10) -> list[dict]:
+        """Top `limit` users by balance, of `dept` or of all departments"""
+
+
+class InMemoryLeaderboard(LeaderboardBackend):
+    """Sorted lists (one per dept plus one overall) kept in the worker memory.
+
+    top() is a slice O(K), a balance change is a bisect remove + insert.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users: dict[int, tuple[tuple, str]] = {}  # user_id -> (rank key, dept)
+        self._ranks: dict[Optional[str], list[tuple]] = {None: []}
+
+    @staticmethod
+    def _key(balance: int, username: str, user_id: int) -> tuple:
+        return (-balance, username, user_id)
+
+    def load(self, entries: Iterable[dict]):
+        users, ranks = {}, {None: []}
+        for entry in entries:
+            key = self._key(entry["balance"], entry["username"], entry["user_id"])
+            users[entry["user_id"]] = (key, entry["dept"])
+            ranks[None].append(key)
+            ranks.setdefault(entry["dept"], []).append(key)
+        for ranking in ranks.values():
+            ranking.sort()
+        with self._lock:
+            self._users, self._ranks = users, ranks
+
+    def apply_deltas(self, deltas: dict[int, int]) -> bool:
+        with self._lock:
+            if any(user_id not in self._users for user_id in deltas):
+                return False
+            for user_id, delta in deltas.items():
+                if not delta:
+                    continue
+                key, dept = self._users[user_id]
+                new_key = (key[0] - delta, key[1], key[2])
+                for ranking in (self._ranks[None], self._ranks[dept]):
+                    del ranking[bisect.bisect_left(ranking, key)]
+                    bisect.insort(ranking, new_key)
+                self._users[user_id] = (new_key, dept)
+        return True
+
+    def top(self, dept: Optional[str] = None, limit: int = 10) -> list[dict]:
+        with self._lock:
+            return [
+                {"username": username, "dept": self._users[user_id][1], "value": -balance}
+                for balance, username, user_id in self._ranks.get(dept, [])[:limit]
+            ]
+
+
+class Leaderboard:
+    """Keeps a backend loaded from `Balance` and in sync with transfers.
+
+    Each worker only sees its own transfers, so the ranking is reloaded
+    when older than `refresh_seconds` (0 never reloads) or after a transfer
+    involving a user it doesn't know.
+
+    Transfers report the `(balance, version)` they wrote, a change is only
+    applied if its version is newer than the known one. Balances reported
+    while a snapshot is read (`loading`) are replayed over it on `load`, so
+    no transfer is lost or counted twice whichever commits first.
+    """
+
+    def __init__(self, backend: LeaderboardBackend, refresh_seconds: float = 0):
+        self.backend = backend
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._balances: dict[int, tuple[int, int]] = {}  # user_id -> (balance, version)
+        self._loads = 0
+        self._pending: Optional[dict[int, tuple[int, int]]] = None
+
+    @property
+    def stale(self) -> bool:
+        if self.loaded_at is None:
+            return True
+        return bool(self.refresh_seconds) and (
+            time.monotonic() - self.loaded_at > self.refresh_seconds
+        )
+
+    @contextmanager
+    def loading(self):
+        """Wraps the read of a snapshot passed to `load`"""
+        with self._lock:
+            self._loads += 1
+            if self._pending is None:
+                self._pending = {}
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._loads -= 1
+                if not self._loads:
+                    self._pending = None
+
+    def load(self, entries: Iterable[dict]):
+        entries = list(entries)
+        with self._lock:
+            self._balances = {
+                entry["user_id"]: (entry["balance"], entry.get("version", 0))
+                for entry in entries
+            }
+            self.backend.load(entries)
+            self.loaded_at = time.monotonic()
+            if self._pending:
+                self._apply(self._pending)
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def apply_balances(self, balances: dict[int, tuple[int, int]]):
+        """Called after a transfer commits with the `user_id -> (balance,
+        version)` it wrote.
+        """
+        with self._lock:
+            if self._pending is not None:
+                for user_id, (balance, version) in balances.items():
+                    if version > self._pending.get(user_id, (0, 0))[1]:
+                        self._pending[user_id] = (balance, version)
+            if self.loaded_at is not None:
+                self._apply(balances)
+
+    def _apply(self, balances: dict[int, tuple[int, int]]):
+        """Moves the backend by the newer balances, must hold the lock"""
+        if any(user_id not in self._balances for user_id in balances):
+            self.invalidate()
+            return
+        deltas = {}
+        for user_id, (balance, version) in balances.items():
+            known, known_version = self._balances[user_id]
+            if version > known_version:
+                deltas[user_id] = balance - known
+                self._balances[user_id] = (balance, version)
+        if deltas and not self.backend.apply_deltas(deltas):
+            self.invalidate()
+
+    def top(self, dept: Optional[str] = None, limit: int = 10) -> list[dict]:
+        return self.backend.top(dept=dept, limit=limit)
+
+
+def balances_query():
+    """Every user with its balance (0 if it has none), to load a Leaderboard"""
+    return select(
+        User.id.label("user_id"),
+        User.username,
+        User.dept,
+        func.coalesce(Balance.value, 0).label("balance"),
+        func.coalesce(Balance.version, 0).label("version"),
+    ).outerjoin(Balance, Balance.user_id == User.id)
+
+
+def get_backend(path: str) -> LeaderboardBackend:
+    """Instantiates a backend from `memory` or a `package.module.Class` path"""
+    if path == "memory":
+        return InMemoryLeaderboard()
+    module, _, name = path.rpartition(".")
+    return getattr(importlib.import_module(module), name)()
+
+
+leaderboard = Leaderboard(
+    get_backend(settings.leaderboard.backend),
+    refresh_seconds=settings.leaderboard.refresh_seconds,
+)
@@ -0,0 +1,168 @@
+"""Prometheus metrics of the API, served on GET /metrics.
+
+With many worker processes (uvicorn --workers, gunicorn) point the
+PROMETHEUS_MULTIPROC_DIR environment variable to an empty directory before
+starting them: each process writes its values there and /metrics sums them.
+"""
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from dundie.db import (
+    InstrumentedAsyncQueuePool,
+    InstrumentedQueuePool,
+    _engines,
+    get_pool_status,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BCRYPT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# Pool connection gauges are refreshed at most once per interval per process
+POOL_GAUGES_INTERVAL = 1.0
+
+logger = logging.getLogger("dundie.metrics")
+
+HTTP_REQUESTS = Counter(
+    "dundie_http_requests_total", "Requests handled", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "dundie_http_request_duration_seconds",
+    "Request latency",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "dundie_http_requests_in_flight", "Requests being handled", multiprocess_mode="livesum"
+)
+
+TRANSACTIONS = Counter("dundie_transactions_total", "Transactions committed")
+TRANSACTION_POINTS = Counter("dundie_transaction_points_total", "Points moved by transactions")
+TRANSACTION_ERRORS = Counter(
+    "dundie_transaction_errors_total", "Rejected transfers (TransactionError)", ["kind"]
+)
+
+PASSWORD_VERIFY = Histogram(
+    "dundie_password_verify_seconds", "bcrypt verify duration", buckets=BCRYPT_BUCKETS
+)
+PASSWORD_HASH = Histogram(
+    "dundie_password_hash_seconds", "bcrypt hash duration", buckets=BCRYPT_BUCKETS
+)
+PASSWORD_HASHER_IN_PROGRESS = Gauge(
+    "dundie_password_hasher_in_progress",
+    "bcrypt operations running on the hasher pools",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASHER_QUEUE_DEPTH = Gauge(
+    "dundie_password_hasher_queue_depth",
+    "bcrypt operations waiting for a hasher pool worker",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASHER_REJECTED = Counter(
+    "dundie_password_hasher_rejected_total", "bcrypt operations rejected (hasher pool busy)"
+)
+
+CACHE_LOOKUPS = Counter(
+    "dundie_cache_lookups_total", "Cache lookups (hit ratio)", ["cache", "result"]
+)
+
+DB_POOL_WAIT = Histogram(
+    "dundie_db_pool_wait_seconds",
+    "Wait for a pooled connection",
+    ["engine"],
+    buckets=POOL_WAIT_BUCKETS,
+)
+DB_POOL_TIMEOUTS = Counter(
+    "dundie_db_pool_timeouts_total", "Pool checkouts that timed out", ["engine"]
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "dundie_db_pool_connections",
+    "Pooled connections by state",
+    ["engine", "state"],
+    multiprocess_mode="livesum",
+)
+
+
+def record_transactions(count: int, points: int):
+    """Counts committed transactions, it never raises: the data is already
+    committed and a metric must not turn the request into an error.
+    """
+    try:
+        TRANSACTIONS.inc(count)
+        TRANSACTION_POINTS.inc(points)
+    except Exception:
+        logger.exception("Failed to record %d transactions (%d points)", count, points)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    HTTP_REQUESTS.labels(method, route, str(status)).inc()
+    HTTP_LATENCY.labels(method, route).observe(seconds)
+
+
+def observe_pool(engine_name: str):
+    """Returns a PoolStats listener feeding the pool wait metrics"""
+    wait = DB_POOL_WAIT.labels(engine_name)
+    timeouts = DB_POOL_TIMEOUTS.labels(engine_name)
+
+    def listener(seconds: float, timeout: bool):
+        wait.observe(seconds)
+        if timeout:
+            timeouts.inc()
+
+    return listener
+
+
+InstrumentedQueuePool.stats.listeners.append(observe_pool("sync"))
+InstrumentedAsyncQueuePool.stats.listeners.append(observe_pool("async"))
+
+_pool_gauges_at = 0.0
+
+
+def refresh_pool_gauges(force: bool = False):
+    """Sets the connection gauges from the pools of the engines in use.
+
+    Called after each request, so every worker keeps its share of the
+    (summed) gauges current, but it reads the pools once per interval.
+    """
+    global _pool_gauges_at
+    now = time.monotonic()
+    if not force and now - _pool_gauges_at < POOL_GAUGES_INTERVAL:
+        return
+    _pool_gauges_at = now
+    engines = {"sync": _engines.get("engine")}
+    if (async_engine := _engines.get("async_engine")) is not None:
+        engines["async"] = async_engine.sync_engine
+    for engine_name, engine in engines.items():
+        if engine is None:
+            continue
+        status = get_pool_status(engine)
+        for state in ("checked_in", "checked_out", "overflow"):
+            if state in status:
+                DB_POOL_CONNECTIONS.labels(engine_name, state).set(status[state])
+
+
+def render() -> tuple[bytes, str]:
+    """Exposition of every metric, summed over the worker processes if any"""
+    refresh_pool_gauges(force=True)
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drops the live gauges of this process (call on worker shutdown)"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
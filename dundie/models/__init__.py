@@ -1,5 +1,21 @@
 from sqlmodel import SQLModel
 from .user import User
-from .transaction import Transaction, Balance
+from .email import EmailOutbox
+from .transaction import (
+    Transaction,
+    TransactionArchive,
+    Balance,
+    LedgerOpening,
+    LedgerSummary,
+)
 
-__all__ = ["User", "SQLModel", "Transaction", "Balance"]
\ No newline at end of file
+__all__ = [
+    "User",
+    "SQLModel",
+    "Transaction",
+    "TransactionArchive",
+    "Balance",
+    "LedgerOpening",
+    "LedgerSummary",
+    "EmailOutbox",
+]
@@ -0,0 +1,23 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Index, Text
+from sqlmodel import SQLModel, Field
+
+
+class EmailOutbox(SQLModel, table=True):
+    """Outbound emails waiting for (or done with) delivery by an OutboxWorker"""
+    __table_args__ = (
+        Index("ix_emailoutbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    to: str = Field(nullable=False)
+    message: str = Field(sa_column=Column(Text, nullable=False))
+    status: str = Field(default="pending", nullable=False)  # pending, sent or failed
+    attempts: int = Field(default=0, nullable=False)
+    # also leases claimed messages to a worker for `email.outbox_lease_seconds`
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    sent_at: Optional[datetime] = None
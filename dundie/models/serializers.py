@@ -1,10 +1,10 @@
-from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, root_validator
-from dundie.db import engine
-from sqlmodel import Session
+from datetime import date, datetime
+from typing import List, Optional
+from pydantic import BaseModel
+from sqlmodel import select
 from dundie.models.user import User
 
+
 class TransactionResponse(BaseModel):
     id: int
     value: int
@@ -13,11 +13,71 @@ class TransactionResponse(BaseModel):
     user: Optional[str] = None
     from_user: Optional[str] = None
 
-    @root_validator(pre=True)
-    def get_usernames(cls, values):
-        with Session(engine) as session:
-            user = session.get(User, values['user_id'])
-            values['user'] = user and user.username
-            fromuser = session.get(User, values['from_id'])
-            values['from_user'] = fromuser and fromuser.username
-        return values
+    @staticmethod
+    def usernames_query(transactions):
+        """Query resolving `id -> username` for every user on `transactions`"""
+        user_ids = {t.user_id for t in transactions} | {t.from_id for t in transactions}
+        return select(User.id, User.username).where(User.id.in_(user_ids))
+
+    @classmethod
+    def from_transactions(cls, transactions, usernames: dict) -> list["TransactionResponse"]:
+        """Serializes a page of transactions with a page level `id -> username` map.
+
+        Build `usernames` with a single `usernames_query` instead of 2 lookups
+        per transaction.
+        """
+        return [
+            cls(
+                id=t.id,
+                value=t.value,
+                date=t.date,
+                user=usernames.get(t.user_id),
+                from_user=usernames.get(t.from_id),
+            )
+            for t in transactions
+        ]
+
+
+class TransactionCursorPage(BaseModel):
+    """A keyset paginated page of transactions"""
+    items: List[TransactionResponse]
+    next: Optional[str] = None  # cursor of the following page
+    total: Optional[int] = None  # only set with include_total=true
+
+
+class TransactionBatchItem(BaseModel):
+    username: str
+    value: int
+
+
+class TransactionBatchRequest(BaseModel):
+    """Serializer for the POST /transaction/batch payload"""
+    items: List[TransactionBatchItem]
+
+
+class LedgerTotals(BaseModel):
+    value: int = 0
+    transactions: int = 0
+
+
+class DailyLedger(BaseModel):
+    day: date
+    received: LedgerTotals = LedgerTotals()
+    sent: LedgerTotals = LedgerTotals()
+
+
+class UserStatsResponse(BaseModel):
+    """Serializer for GET /user/{username}/stats (from the ledger summary)"""
+    username: str
+    since: date
+    until: date
+    received: LedgerTotals
+    sent: LedgerTotals
+    daily: List[DailyLedger]
+
+
+class LeaderboardEntry(BaseModel):
+    username: str
+    dept: str
+    value: int
+    transactions: Optional[int] = None
@@ -1,6 +1,7 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import TYPE_CHECKING, Optional
 
+from sqlalchemy import Index, literal_column
 from sqlmodel import SQLModel, Field, Relationship
 
 if TYPE_CHECKING:
@@ -8,6 +9,12 @@ if TYPE_CHECKING:
 
 
 class Transaction(SQLModel, table=True):
+    # user/from_user filters are always ordered by date (history, pagination)
+    __table_args__ = (
+        Index("ix_transaction_user_id_date", "user_id", "date"),
+        Index("ix_transaction_from_id_date", "from_id", "date"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", nullable=False)
     from_id: int = Field(foreign_key="user.id", nullable=False)
@@ -27,6 +34,34 @@ class Transaction(SQLModel, table=True):
     )
 
 
+class TransactionArchive(SQLModel, table=True):
+    """Transactions older than the `ledger.archive_after_days` horizon.
+
+    Same columns (and ids) as `Transaction`, moved by `archive_ledger`.
+    """
+    __table_args__ = (
+        Index("ix_transactionarchive_user_id_date", "user_id", "date"),
+        Index("ix_transactionarchive_from_id_date", "from_id", "date"),
+        Index("ix_transactionarchive_date", "date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", nullable=False)
+    from_id: int = Field(foreign_key="user.id", nullable=False)
+    value: int = Field(nullable=False)
+    date: datetime = Field(nullable=False)
+
+
+class LedgerOpening(SQLModel, table=True):
+    """Net points of the archived transactions of a user (opening balance).
+
+    Opening balance + live transactions == Balance.
+    """
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    value: int = Field(default=0, nullable=False)
+    until: datetime = Field(nullable=False)  # archived transactions are older
+
+
 class Balance(SQLModel, table=True):
     user_id: int = Field(foreign_key="user.id",
         nullable=False,
@@ -39,5 +74,28 @@ class Balance(SQLModel, table=True):
         nullable=False,
         sa_column_kwargs={"onupdate": datetime.utcnow}
     )
+    # bumped by every UPDATE of the row, orders the changes the leaderboard sees
+    version: int = Field(
+        default=1,
+        nullable=False,
+        sa_column_kwargs={"server_default": "1", "onupdate": literal_column("version + 1")},
+    )
+
+    user: Optional["User"] = Relationship(back_populates="_balance")
+
+
+class LedgerSummary(SQLModel, table=True):
+    """Daily totals of points received (income) and sent (expense) per user.
+
+    Maintained incrementally by add_transaction so analytics never scan
+    the `transaction` table.
+    """
+    __table_args__ = (
+        Index("ix_ledgersummary_direction_day", "direction", "day"),
+    )
 
-    user: Optional["User"] = Relationship(back_populates="_balance")
\ No newline at end of file
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    direction: str = Field(primary_key=True)  # income or expense
+    value: int = Field(default=0, nullable=False)
+    transactions: int = Field(default=0, nullable=False)
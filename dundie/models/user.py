@@ -1,9 +1,10 @@
-from pydantic import BaseModel, root_validator
+from pydantic import BaseModel, root_validator, validator
 from typing import Optional, TYPE_CHECKING
+from sqlalchemy import literal_column
 from sqlmodel import SQLModel, Session, select, Field, Relationship
-from dundie.db import engine
+from dundie.config import settings
+from dundie.db import get_engine
 from dundie.security import HashedPassword, get_password_hash
-from fastapi import HTTPException, status
 
 if TYPE_CHECKING:
     from dundie.models.transaction import Transaction, Balance
@@ -12,14 +13,20 @@ class User(SQLModel, table=True):
     """ User model """
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    username: str = Field(nullable=False)
-    email: str = Field(nullable=None)
+    username: str = Field(nullable=False, unique=True, index=True)
+    email: str = Field(nullable=None, index=True)
     password: HashedPassword
     name: str = Field(nullable=None)
     avatar: Optional[str] = None
     bio: Optional[str] = None
     dept: Optional[str] = Field(nullable=False)
     currency: Optional[str] = Field(nullable=False)
+    # bumped by every UPDATE of the row, ETags of user reads are built from it
+    version: int = Field(
+        default=1,
+        nullable=False,
+        sa_column_kwargs={"server_default": "1", "onupdate": literal_column("version + 1")},
+    )
 
     incomes: Optional[list["Transaction"]] = Relationship(
         back_populates="user",
@@ -56,7 +63,7 @@ def generate_username(name: str) -> str:
 
 def get_user(username: str) -> Optional[User]:
     query = select(User).where(User.username == username)
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         return session.exec(query).first()
 
 
@@ -71,14 +78,9 @@ class UserResponse(BaseModel):
 
 
 class UserResponseWithBalance(UserResponse):
+    """Serializer for User Response with the balance LEFT JOINed in the query"""
     balance: Optional[int] =  None
 
-    @root_validator(pre=True)
-    def set_balance(cls, values):
-        instance = values['_sa_instance_state'].object  # Instrospeccao do SQLAlchemy para evitar fazer nova query com session
-        values['balance'] = instance.balance
-        return values
-
 class UserRequest(BaseModel):
     """Serializer for User request payload"""
     name: str
@@ -93,11 +95,30 @@ class UserRequest(BaseModel):
     @root_validator(pre=True)
     def generate_username_if_not_set(cls, values):
         """Generates username if not set"""
-        if values.get("username") is None:
+        if values.get("username") is None and values.get("name"):
             values["username"] = generate_username(values["name"])
         return values
 
 
+class UserBulkRequest(BaseModel):
+    """Serializer for the POST /user/bulk payload"""
+    items: list[UserRequest]
+
+    @validator("items", pre=True)
+    def limit_items(cls, items):
+        """Every password is hashed in the request, cap the CPU it can take"""
+        from fastapi import HTTPException, status
+
+        max_items = settings.security.bulk_max_items
+        if isinstance(items, list) and len(items) > max_items:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"At most {max_items} users per request, "
+                "use `dundie import-users` for larger imports",
+            )
+        return items
+
+
 class UserProfilePatchRequest(BaseModel):
     """Serializer for User Profile"""
     avatar: Optional[str] = None
@@ -105,6 +126,8 @@ class UserProfilePatchRequest(BaseModel):
 
     @root_validator(pre=True)
     def ensure_values(cls, values):
+        from fastapi import HTTPException  # keeps the models importable without the web stack
+
         if not values:
             raise HTTPException(status_code=400, detail="Bad request, no data informed")
         return values
@@ -117,6 +140,8 @@ class UserPasswordPatchRequest(BaseModel):
     @root_validator(pre=True)
     def check_passwords_match(cls, values):
         """Checks if passwords match"""
+        from fastapi import HTTPException, status
+
         if values.get("password") != values.get("password_confirm"):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -0,0 +1,116 @@
+"""Sampling profiler that can be switched on in a running worker.
+
+A background thread takes the Python stack of every thread each `interval`
+seconds (`sys._current_frames`), the profiled code runs untouched. Stacks
+are exported as collapsed stacks (flamegraph.pl, speedscope) or as a
+speedscope JSON file, one profile per thread.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads until `stop` or `seconds` elapsed"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()  # (thread name, code objects root first)
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: Optional[float] = None) -> "SamplingProfiler":
+        self.started_at = time.time()
+        self._thread = threading.Thread(
+            target=self._run, args=(seconds,), name="dundie-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self, seconds: Optional[float]):
+        own = threading.get_ident()
+        names: dict[int, str] = {}
+        start = time.perf_counter()
+        deadline = start + seconds if seconds else None
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names.update((t.ident, t.name) for t in threading.enumerate())
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[(names.get(ident, str(ident)), tuple(stack))] += 1
+            if deadline and time.perf_counter() >= deadline:
+                break
+        self.duration = time.perf_counter() - start
+
+    @staticmethod
+    def _frame_name(code) -> str:
+        return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+    def collapsed(self) -> str:
+        """One `thread;frame;...;frame count` line per distinct stack"""
+        lines = [
+            ";".join([thread, *map(self._frame_name, stack)]) + f" {count}"
+            for (thread, stack), count in self.samples.most_common()
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def speedscope(self, name: str = "dundie") -> dict:
+        """speedscope.app file: one sampled profile (weights in seconds) per thread"""
+        frames: list[dict] = []
+        index: dict = {}
+        profiles: dict[str, dict] = {}
+        for (thread, stack), count in self.samples.items():
+            for code in stack:
+                if code not in index:
+                    index[code] = len(frames)
+                    frames.append(
+                        {
+                            "name": code.co_name,
+                            "file": code.co_filename,
+                            "line": code.co_firstlineno,
+                        }
+                    )
+            profile = profiles.setdefault(
+                thread,
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": round(self.duration, 6),
+                    "samples": [],
+                    "weights": [],
+                },
+            )
+            profile["samples"].append([index[code] for code in stack])
+            profile["weights"].append(round(count * self.interval, 6))
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": f"{name} pid {os.getpid()}",
+            "exporter": "dundie",
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda p: -sum(p["weights"])),
+        }
@@ -2,9 +2,15 @@ from fastapi import APIRouter
 from .user import router as user_router
 from .auth import router as auth_router
 from .transaction import router as transaction_router
+from .metrics import router as metrics_router
+from .leaderboard import router as leaderboard_router
+from .profiler import router as profiler_router
 
 main_router = APIRouter()
 
 main_router.include_router(user_router, prefix="/user", tags=["user"])
 main_router.include_router(auth_router, tags=["auth"])
 main_router.include_router(transaction_router, prefix="/transaction", tags=["transaction"])
+main_router.include_router(metrics_router, tags=["metrics"])
+main_router.include_router(leaderboard_router, prefix="/leaderboard", tags=["leaderboard"])
+main_router.include_router(profiler_router, prefix="/profiler", tags=["profiler"])
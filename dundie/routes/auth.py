@@ -7,13 +7,14 @@ from dundie.auth import (
     RefreshToken,
     Token,
     User,
-    authenticate_user,
+    authenticate_user_async,
     create_access_token,
     create_refresh_token,
     get_user,
     validate_token,
 )
 from dundie.config import settings
+from dundie.security import password_fingerprint
 
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.security.access_token_expire_minutes  
 REFRESH_TOKEN_EXPIRE_MINUTES = settings.security.refresh_token_expire_minutes  
@@ -25,7 +26,7 @@ router = APIRouter()
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
-    user = authenticate_user(get_user, form_data.username, form_data.password)
+    user = await authenticate_user_async(get_user, form_data.username, form_data.password)
     if not user or not isinstance(user, User):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -33,15 +34,17 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    pwd = password_fingerprint(user.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)  
     access_token = create_access_token(
-        data={"sub": user.username, "fresh": True},
+        data={"sub": user.username, "fresh": True, "pwd": pwd},
         expires_delta=access_token_expires,
     )
 
     refresh_token_expires = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)  
     refresh_token = create_refresh_token(
-        data={"sub": user.username}, expires_delta=refresh_token_expires
+        data={"sub": user.username, "pwd": pwd},
+        expires_delta=refresh_token_expires,
     )
 
     return {
@@ -55,15 +58,17 @@ async def login_for_access_token(
 async def refresh_token(form_data: RefreshToken):
     user = await validate_token(token=form_data.refresh_token)
 
+    pwd = password_fingerprint(user.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)  
     access_token = create_access_token(
-        data={"sub": user.username, "fresh": False},
+        data={"sub": user.username, "fresh": False, "pwd": pwd},
         expires_delta=access_token_expires,
     )
 
     refresh_token_expires = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)  
     refresh_token = create_refresh_token(
-        data={"sub": user.username}, expires_delta=refresh_token_expires
+        data={"sub": user.username, "pwd": pwd},
+        expires_delta=refresh_token_expires,
     )
 
     return {
@@ -0,0 +1,75 @@
+from datetime import date, datetime
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Query
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from dundie.auth import AuthenticatedUser
+from dundie.db import AsyncActiveSession
+from dundie.leaderboard import balances_query, leaderboard as ranking
+from dundie.metrics import CACHE_LOOKUPS
+from dundie.models.serializers import LeaderboardEntry
+from dundie.models.transaction import LedgerSummary
+from dundie.models.user import User
+
+router = APIRouter()
+
+DIRECTIONS = {"received": "income", "sent": "expense"}
+
+
+async def load_ranking(session: AsyncSession):
+    """(Re)loads the balance ranking from the database"""
+    with ranking.loading():
+        rows = (await session.exec(balances_query())).all()
+        ranking.load(dict(row._mapping) for row in rows)
+
+
+@router.get("/", response_model=List[LeaderboardEntry], dependencies=[AuthenticatedUser])
+async def leaderboard(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    by: Literal["balance", "received", "sent"] = "balance",
+    since: Optional[date] = None,  # defaults to the first day of the current month
+    until: Optional[date] = None,  # defaults to today
+    dept: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Top users by current balance (from the in memory ranking) or by points
+    received or sent in the period (from the ledger summary).
+    """
+    if by == "balance":
+        if ranking.stale:
+            CACHE_LOOKUPS.labels("leaderboard", "miss").inc()
+            await load_ranking(session)
+        else:
+            CACHE_LOOKUPS.labels("leaderboard", "hit").inc()
+        return ranking.top(dept=dept, limit=limit)
+
+    today = datetime.utcnow().date()
+    since = since or today.replace(day=1)
+    until = until or today
+
+    value = func.sum(LedgerSummary.value).label("value")
+    query = (
+        select(
+            User.username,
+            User.dept,
+            value,
+            func.sum(LedgerSummary.transactions).label("transactions"),
+        )
+        .join(User, User.id == LedgerSummary.user_id)
+        .where(
+            LedgerSummary.direction == DIRECTIONS[by],
+            LedgerSummary.day >= since,
+            LedgerSummary.day <= until,
+        )
+        .group_by(User.id, User.username, User.dept)
+        .order_by(value.desc(), User.username)
+        .limit(limit)
+    )
+    if dept:
+        query = query.where(User.dept == dept)
+
+    return [dict(row._mapping) for row in (await session.exec(query)).all()]
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Response
+
+from dundie.auth import AuthenticatedSuperUser
+from dundie.db import get_async_engine, get_engine, get_pool_status
+from dundie.metrics import render
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus exposition of every worker process"""
+    content, content_type = render()
+    return Response(content=content, media_type=content_type)
+
+
+@router.get("/metrics/db", dependencies=[AuthenticatedSuperUser])
+async def db_pool_metrics():
+    """Connection pool usage and checkout wait times of this worker"""
+    return {
+        "sync": get_pool_status(get_engine()),
+        "async": get_pool_status(get_async_engine().sync_engine),
+    }
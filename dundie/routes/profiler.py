@@ -0,0 +1,54 @@
+import os
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+from dundie.auth import AuthenticatedSuperUser
+from dundie.config import settings
+from dundie.profiler import SamplingProfiler
+
+router = APIRouter()
+
+ProfileFormat = Literal["speedscope", "collapsed"]
+
+# Profiler of this worker, each uvicorn worker process has its own
+worker_profiler: Optional[SamplingProfiler] = None
+
+
+def profile_response(
+    profiler: SamplingProfiler, format: str, headers: Optional[dict] = None
+) -> Response:
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed(), headers=headers)
+    return JSONResponse(profiler.speedscope(), headers=headers)
+
+
+@router.post("/start", dependencies=[AuthenticatedSuperUser])
+async def start_profiler(
+    seconds: int = Query(30, ge=1, le=settings.profiler.max_seconds),
+    interval_ms: float = Query(settings.profiler.interval_ms, ge=1, le=1000),
+):
+    """Starts sampling this worker, it stops by itself after `seconds`"""
+    global worker_profiler
+    if worker_profiler is not None and worker_profiler.running:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Profiler already running"
+        )
+    worker_profiler = SamplingProfiler(interval=interval_ms / 1000).start(seconds)
+    return {"pid": os.getpid(), "seconds": seconds, "interval_ms": interval_ms}
+
+
+@router.post("/stop", dependencies=[AuthenticatedSuperUser])
+async def stop_profiler(format: ProfileFormat = "speedscope"):
+    """Stops the profiler (if still running) and returns its profile.
+
+    With many workers send it to the worker (`pid`) that was started.
+    """
+    if worker_profiler is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Profiler not started on worker {os.getpid()}",
+        )
+    worker_profiler.stop()
+    return profile_response(worker_profiler, format, {"X-Profile-Pid": str(os.getpid())})
@@ -1,34 +1,88 @@
-from typing import Optional, List
-from fastapi import APIRouter, HTTPException, Depends, status, Body
-from sqlmodel import Session, select, text
+import base64
+import json
+from datetime import datetime
+from functools import partial
+from typing import Literal, Optional, List
+from fastapi import APIRouter, HTTPException, Depends, Query, status, Body
+from sqlalchemy import func, tuple_, union_all
+from sqlmodel import select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import aliased
 
+from dundie.models.transaction import TransactionArchive
 from dundie.models.user import User
-from dundie.tasks.transaction import add_transaction, TransactionError, Transaction
-from dundie.db import ActiveSession
+from dundie.tasks.transaction import (
+    add_transaction,
+    add_transactions_batch,
+    run_transaction_async,
+    Transaction,
+    TransactionBatchError,
+    TransactionError,
+)
+from dundie.db import AsyncActiveSession
 from dundie.auth import AuthenticatedUser
-from dundie.models.serializers import TransactionResponse
+from dundie.config import settings
+from dundie.models.serializers import (
+    TransactionBatchRequest,
+    TransactionCursorPage,
+    TransactionResponse,
+)
 
 from fastapi_pagination import Page, Params
 from fastapi_pagination.ext.sqlmodel import paginate
 
+PAGE_SIZE = settings.pagination.page_size
+MAX_PAGE_SIZE = settings.pagination.max_page_size
+
 router = APIRouter()
 
+
+@router.post("/batch", status_code=201)
+async def create_transactions_batch(
+    *,
+    batch: TransactionBatchRequest,
+    current_user: User = AuthenticatedUser,
+    session: AsyncSession = AsyncActiveSession
+):
+    """Adds a transaction from the current user to each item, all or nothing"""
+    items = [(item.username, item.value) for item in batch.items]
+    try:
+        result = await run_transaction_async(
+            session,
+            lambda sync_session: add_transactions_batch(
+                items=items, from_user=current_user, session=sync_session, retry=False
+            ),
+        )
+    except TransactionBatchError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": str(e), "errors": e.errors}
+        )
+    return {"message": "Transactions added", **result}
+
+
 @router.post("/{username}/", status_code=201)
 async def create_transaction(
     *, 
     username: str,
     value: int = Body(embed=True),
     current_user: User = AuthenticatedUser,
-    session: Session = ActiveSession
+    session: AsyncSession = AsyncActiveSession
 ):
     """Adds a new transaction to a specified user"""
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = (await session.exec(select(User).where(User.username == username))).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     try:
-        add_transaction(user=user, from_user=current_user, value=value, session=session)
+        # add_transaction e sync, run_sync executa no greenlet da sessao async
+        await run_transaction_async(
+            session,
+            lambda sync_session: add_transaction(
+                user=user, from_user=current_user, value=value, session=sync_session,
+                retry=False,
+            ),
+        )
     except TransactionError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -37,35 +91,90 @@ async def create_transaction(
     return {"message": "Transaction added"}
 
 
-@router.get("/", response_model=Page[TransactionResponse])
-async def list_transactions(
-    *,
-    current_user: User = AuthenticatedUser,
-    session: Session = ActiveSession,
-    params: Params = Depends(),
+def filter_transactions(
+    query,
+    current_user: User,
     user: Optional[str] = None,
     from_user: Optional[str] = None,
-    order_by: Optional[str] = None,   # &order_by=date ou &order_by=-date 
+    model=Transaction,
 ):
-    """List all transactions"""
-    query = select(Transaction)
-
-    # Optional filters
+    """Applies the optional username filters and the access filters to `query`
+    selecting from `model` (Transaction or TransactionArchive).
+    """
     if user:
         query = query.join(
-            User, Transaction.user_id == User.id
+            User, model.user_id == User.id
         ).where(User.username == user)
     if from_user:
         FromUser = aliased(User)  # aliased needed to desambiguous the join
         query = query.join(
-            FromUser, Transaction.from_id == FromUser.id
+            FromUser, model.from_id == FromUser.id
         ).where(FromUser.username == from_user)
 
     # access filters
     if not current_user.superuser:
         query = query.where(
-            (Transaction.user_id == current_user.id) | (Transaction.from_id == current_user.id)
+            (model.user_id == current_user.id) | (model.from_id == current_user.id)
         )
+    return query
+
+
+async def transactions_query(
+    session: AsyncSession,
+    current_user: User,
+    user: Optional[str] = None,
+    from_user: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """Returns `(query, entity)` selecting the filtered transactions.
+
+    Archived transactions are only read (UNION ALL with the live table) when
+    the range starts before the newest archived one, `entity` is the
+    Transaction model or its alias over the union, use it to order/filter.
+    """
+    def branch(model):
+        query = filter_transactions(select(model), current_user, user, from_user, model)
+        if since:
+            query = query.where(model.date >= since)
+        if until:
+            query = query.where(model.date < until)
+        return query
+
+    query = branch(Transaction)
+    horizon = (await session.exec(select(func.max(TransactionArchive.date)))).one()
+    if horizon is None or (since and since > horizon):
+        return query, Transaction
+
+    ledger = aliased(Transaction, union_all(query, branch(TransactionArchive)).subquery())
+    return select(ledger), ledger
+
+
+async def serialize_transactions(session: AsyncSession, transactions):
+    """Serializes transactions resolving all usernames in a single query"""
+    usernames = {}
+    if transactions:
+        query = TransactionResponse.usernames_query(transactions)
+        usernames = dict((await session.exec(query)).all())
+    return TransactionResponse.from_transactions(transactions, usernames)
+
+
+@router.get("/", response_model=Page[TransactionResponse])
+async def list_transactions(
+    *,
+    current_user: User = AuthenticatedUser,
+    session: AsyncSession = AsyncActiveSession,
+    params: Params = Depends(),
+    user: Optional[str] = None,
+    from_user: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order_by: Optional[str] = None,   # &order_by=date ou &order_by=-date 
+):
+    """List all transactions, archived ones included when the range needs them"""
+    query, _ = await transactions_query(
+        session, current_user, user, from_user, since, until
+    )
 
     if order_by:
         order_text = text(
@@ -73,4 +182,72 @@ async def list_transactions(
         )
         query = query.order_by(order_text)
 
-    return paginate(query=query, session=session, params=params)
+    return await paginate(
+        session,
+        query,
+        params,
+        transformer=partial(serialize_transactions, session),
+    )
+
+
+def encode_cursor(transaction: Transaction) -> str:
+    """Opaque cursor pointing after `transaction` in (date, id) order"""
+    raw = json.dumps([transaction.date.isoformat(), transaction.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        date, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(date), int(id_)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+@router.get("/cursor/", response_model=TransactionCursorPage)
+async def list_transactions_by_cursor(
+    *,
+    current_user: User = AuthenticatedUser,
+    session: AsyncSession = AsyncActiveSession,
+    cursor: Optional[str] = None,
+    size: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = False,
+    user: Optional[str] = None,
+    from_user: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order_by: Literal["date", "-date"] = "-date",
+):
+    """List transactions using keyset pagination on (date, id).
+
+    Pass the `next` cursor of a page to get the following one, deep pages
+    cost the same as the first one. `total` is only counted on request.
+    """
+    query, ledger = await transactions_query(
+        session, current_user, user, from_user, since, until
+    )
+    position = tuple_(ledger.date, ledger.id)
+
+    if order_by == "date":
+        query = query.order_by(ledger.date, ledger.id)
+    else:
+        query = query.order_by(ledger.date.desc(), ledger.id.desc())
+
+    total = None
+    if include_total:
+        count_query = select(func.count()).select_from(query.order_by(None).subquery())
+        total = (await session.exec(count_query)).one()
+
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        query = query.where(position > after if order_by == "date" else position < after)
+
+    transactions = (await session.exec(query.limit(size + 1))).all()
+    has_next = len(transactions) > size
+    transactions = transactions[:size]
+
+    return TransactionCursorPage(
+        items=await serialize_transactions(session, transactions),
+        next=encode_cursor(transactions[-1]) if has_next else None,
+        total=total,
+    )
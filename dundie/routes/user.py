@@ -1,7 +1,11 @@
-from typing import List
+import hashlib
+from datetime import date, datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, status, Body, BackgroundTasks
-from sqlmodel import Session, select
+from fastapi import APIRouter, HTTPException, Query, Request, status, Body, BackgroundTasks
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from dundie.models.user import (
@@ -9,20 +13,101 @@ from dundie.models.user import (
     UserResponse, 
     UserResponseWithBalance,
     UserRequest, 
+    UserBulkRequest,
     UserProfilePatchRequest, 
     UserPasswordPatchRequest
 )
-from dundie.db import ActiveSession
-from dundie.auth import AuthenticatedUser, AuthenticatedSuperUser, CanChangeUserPassword
-from dundie.tasks.user import try_to_send_pwd_reset_email
+from dundie.config import settings
+from dundie.db import AsyncActiveSession, get_async_session_maker
+from dundie.models.transaction import Balance, LedgerSummary
+from dundie.models.serializers import DailyLedger, LedgerTotals, UserStatsResponse
+from dundie.auth import (
+    AuthenticatedUser,
+    AuthenticatedSuperUser,
+    CanChangeUserPassword,
+    token_cache,
+)
+from dundie.security import get_password_hash_async, hash_passwords, pwd_hasher
+from dundie.tasks.user import check_new_users, insert_users, try_to_send_pwd_reset_email
 
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import parse_obj_as
 from dundie.auth import ShowBalanceField
 
+PAGE_SIZE = settings.pagination.page_size
+MAX_PAGE_SIZE = settings.pagination.max_page_size
+STREAM_BATCH_SIZE = 1000
+CACHE_MAX_AGE = settings.http.cache_max_age
+
 router = APIRouter()
 
+
+def user_version_query(show_balance: bool = False):
+    """Selects only the columns the ETag is built from (see make_etag)"""
+    query = select(User.id, User.version)
+    if show_balance:
+        query = query.add_columns(
+            func.coalesce(Balance.version, 0).label("balance_version")
+        ).outerjoin(Balance, Balance.user_id == User.id)
+    return query.order_by(User.id)
+
+
+def user_response_query(show_balance: bool = False):
+    """Selects only the columns of UserResponse (plus id for keyset paging
+    and the ETag versions).
+
+    With `show_balance` the balance comes in the same statement (LEFT JOIN).
+    """
+    query = user_version_query(show_balance).add_columns(
+        User.name, User.username, User.dept, User.avatar, User.bio, User.currency
+    )
+    if show_balance:
+        query = query.add_columns(func.coalesce(Balance.value, 0).label("balance"))
+    return query
+
+
+def make_etag(rows, show_balance: bool = False) -> str:
+    """Strong ETag of the users of `rows` from their versions (and balance
+    versions, bumped by every balance update), equal versions always give
+    the same representation.
+    """
+    digest = hashlib.sha1(b"balance" if show_balance else b"user")
+    for row in rows:
+        digest.update(f"{row.id}:{row.version}:{getattr(row, 'balance_version', '')};".encode())
+    return f'"{digest.hexdigest()[:24]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison (W/ prefixes are ignored)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+
+def cache_headers(etag: str) -> dict:
+    # private: the balance is only shown to its owner and superusers
+    return {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={CACHE_MAX_AGE}, must-revalidate",
+        "Vary": "Authorization",
+    }
+
+
+async def stream_users(query, serializer):
+    """Streams the rows of `query` as a JSON array, fetching them in batches"""
+    async with get_async_session_maker()() as session:
+        result = await session.stream(query)
+        yield "["
+        separator = ""
+        async for rows in result.partitions(STREAM_BATCH_SIZE):
+            yield separator + ",".join(serializer.parse_obj(row._mapping).json() for row in rows)
+            separator = ","
+        yield "]"
+
+
 @router.get(
     "/", 
     response_model=List[UserResponse] | List[UserResponseWithBalance],
@@ -30,16 +115,49 @@ router = APIRouter()
 )
 async def list_users(
     *, 
-    session: Session = ActiveSession,
+    request: Request,
+    session: AsyncSession = AsyncActiveSession,
     show_balance_field: bool = ShowBalanceField,
+    after: Optional[int] = None,  # id of the last user of the previous page
+    size: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
 ):
-    """List all users from database"""
-    users = session.exec(select(User)).all()
-    # TODO: Adicionar paginação
-    if show_balance_field:
-        users_with_balance = parse_obj_as(List[UserResponseWithBalance], users)
-        return JSONResponse(jsonable_encoder(users_with_balance))
-    return users
+    """List users from database ordered by id.
+
+    Pages are keyset paginated: the `Link` header points to the next page.
+    With `stream=true` all users (after `after`) are streamed as a JSON array.
+    Pages have an ETag, a matching `If-None-Match` gets a 304 checked with
+    a query of the user versions only.
+    """
+    serializer = UserResponseWithBalance if show_balance_field else UserResponse
+    query = user_response_query(show_balance=show_balance_field)
+    if after is not None:
+        query = query.where(User.id > after)
+
+    if stream:
+        return StreamingResponse(
+            stream_users(query, serializer), media_type="application/json"
+        )
+
+    if if_none_match := request.headers.get("if-none-match"):
+        version_query = user_version_query(show_balance=show_balance_field)
+        if after is not None:
+            version_query = version_query.where(User.id > after)
+        versions = (await session.exec(version_query.limit(size + 1))).all()
+        etag = make_etag(versions, show_balance_field)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+
+    rows = (await session.exec(query.limit(size + 1))).all()
+    # the extra row tells if there is a next page, it is part of the ETag too
+    headers = cache_headers(make_etag(rows, show_balance_field))
+    if len(rows) > size:
+        rows = rows[:size]
+        next_url = request.url.include_query_params(after=rows[-1].id)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    users = parse_obj_as(List[serializer], [row._mapping for row in rows])
+    return JSONResponse(jsonable_encoder(users, exclude_unset=True), headers=headers)
 
 
 @router.get("/{username}/",
@@ -48,57 +166,149 @@ async def list_users(
 )
 async def get_user_by_username(
     *, 
-    session: Session = ActiveSession, 
+    request: Request,
+    session: AsyncSession = AsyncActiveSession, 
     username: str,
     show_balance_field: bool = ShowBalanceField,
 ):
-    """Get user by username"""
-    query = select(User).where(User.username == username)
-    user = session.exec(query).first()
-    if not user:
+    """Get user by username, a matching `If-None-Match` gets a 304"""
+    if if_none_match := request.headers.get("if-none-match"):
+        version_query = user_version_query(show_balance=show_balance_field)
+        version = (await session.exec(version_query.where(User.username == username))).first()
+        if version is not None:
+            etag = make_etag([version], show_balance_field)
+            if etag_matches(if_none_match, etag):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag)
+                )
+
+    query = user_response_query(show_balance=show_balance_field)
+    row = (await session.exec(query.where(User.username == username))).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-    if show_balance_field:
-        users_with_balance = parse_obj_as(UserResponseWithBalance, user)
-        return JSONResponse(jsonable_encoder(users_with_balance))
-    return user
+    serializer = UserResponseWithBalance if show_balance_field else UserResponse
+    return JSONResponse(
+        jsonable_encoder(serializer.parse_obj(row._mapping)),
+        headers=cache_headers(make_etag([row], show_balance_field)),
+    )
+
+
+@router.get("/{username}/stats", response_model=UserStatsResponse)
+async def get_user_stats(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    current_user: User = AuthenticatedUser,
+    username: str,
+    since: Optional[date] = None,  # defaults to the first day of the current month
+    until: Optional[date] = None,  # defaults to today
+):
+    """Points received and sent by the user per day, from the ledger summary"""
+    today = datetime.utcnow().date()
+    since = since or today.replace(day=1)
+    until = until or today
+
+    user_id = (await session.exec(select(User.id).where(User.username == username))).first()
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if user_id != current_user.id and not current_user.superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="You can only see your own stats"
+        )
+
+    query = select(
+        LedgerSummary.day,
+        LedgerSummary.direction,
+        LedgerSummary.value,
+        LedgerSummary.transactions,
+    ).where(
+        LedgerSummary.user_id == user_id,
+        LedgerSummary.day >= since,
+        LedgerSummary.day <= until,
+    ).order_by(LedgerSummary.day)
+
+    received, sent = LedgerTotals(), LedgerTotals()
+    daily: dict[date, DailyLedger] = {}
+    for day, direction, value, transactions in (await session.exec(query)).all():
+        totals = LedgerTotals(value=value, transactions=transactions)
+        period = received if direction == "income" else sent
+        period.value += value
+        period.transactions += transactions
+        entry = daily.setdefault(day, DailyLedger(day=day))
+        setattr(entry, "received" if direction == "income" else "sent", totals)
+
+    return UserStatsResponse(
+        username=username,
+        since=since,
+        until=until,
+        received=received,
+        sent=sent,
+        daily=list(daily.values()),
+    )
 
 
 @router.post("/", status_code=201, dependencies=[AuthenticatedSuperUser])
 async def create_user(
-    *, session: Session = ActiveSession, user: UserRequest
+    *, session: AsyncSession = AsyncActiveSession, user: UserRequest
 ) -> UserResponse:
     """Creates new user"""
     # LBYL - Look at before you leap
     #        Olhe antes de saltar
-    if session.exec(select(User).where(User.username == user.username)).first():
+    if (await session.exec(select(User).where(User.username == user.username))).first():
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, 
                             detail="Username already taken"
                             )
     
+    user.password = await get_password_hash_async(user.password)
     db_user = User.from_orm(user)  # transform UserRequest in User
     session.add(db_user)
     # EAFP - Easier ask for forgiveness than permission 
     #        Melhor pedir perdão que permissão
     try:
-        session.commit()
+        await session.commit()
     except IntegrityError:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database integrityError"
         )
-    session.refresh(db_user)
+    await session.refresh(db_user)
     return db_user
 
 
+@router.post("/bulk", status_code=201, dependencies=[AuthenticatedSuperUser])
+async def create_users_bulk(
+    *, session: AsyncSession = AsyncActiveSession, bulk: UserBulkRequest
+):
+    """Creates many users at once, taken or repeated usernames are skipped.
+
+    Conflicts are checked with a single query, passwords are hashed on a
+    process pool and users are inserted in chunks in a single commit.
+    At most `security.bulk_max_items` users (413 above it).
+    """
+    users, errors = await session.run_sync(
+        lambda sync_session: check_new_users(sync_session, bulk.items)
+    )
+    hashes = await pwd_hasher.run(hash_passwords, [user.password for user in users])
+    try:
+        created = await session.run_sync(
+            lambda sync_session: insert_users(sync_session, users, hashes)
+        )
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username already taken, try again"
+        )
+    return {"created": created, "skipped": errors}
+
+
 @router.patch("/{username}/")
 async def update_user(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     patch_data: UserProfilePatchRequest,
     current_user: User = AuthenticatedUser,
     username: str
 ) -> UserResponse:
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = (await session.exec(select(User).where(User.username == username))).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     if user.id != current_user.id and not current_user.superuser:
@@ -109,21 +319,22 @@ async def update_user(
     user.bio = patch_data.bio
 
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     return user
 
 @router.post("/{username}/password/")
 async def change_password(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     patch_data: UserPasswordPatchRequest,
     user: User = CanChangeUserPassword
 ) -> UserResponse:
-    user.password = patch_data.hashed_password  
+    user.password = await get_password_hash_async(patch_data.password)
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
+    token_cache.invalidate_user(user.username)
     return user
 
 
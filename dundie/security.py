@@ -1,17 +1,144 @@
 """Security utilities"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
 from passlib.context import CryptContext
 
+from dundie.config import settings
+from dundie.metrics import (
+    PASSWORD_HASH,
+    PASSWORD_HASHER_IN_PROGRESS,
+    PASSWORD_HASHER_QUEUE_DEPTH,
+    PASSWORD_HASHER_REJECTED,
+    PASSWORD_VERIFY,
+)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def verify_password(plain_password, hashed_password) -> bool:
     """Verifies a hash against a password"""
-    return pwd_context.verify(plain_password, hashed_password)
+    with PASSWORD_VERIFY.time():
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password) -> str:
     """Generates a hash from plain text"""
-    return pwd_context.hash(password)
+    with PASSWORD_HASH.time():
+        return pwd_context.hash(password)
+
+
+def password_fingerprint(hashed_password: str) -> str:
+    """Short digest of a password hash, it changes with every new password.
+
+    Tokens carry it (`pwd` claim) so changing the password revokes them.
+    """
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+
+def hash_passwords(passwords: list[str], processes: Optional[int] = None) -> list[str]:
+    """Hashes many passwords in parallel on a process pool (bulk imports).
+
+    `processes` defaults to `security.pwd_hash_processes` (0 is one per cpu),
+    a handful of passwords is hashed inline as spawning costs more.
+    """
+    processes = processes or settings.security.pwd_hash_processes or os.cpu_count() or 1
+    if processes == 1 or len(passwords) <= processes:
+        return [get_password_hash(password) for password in passwords]
+    # spawn: forking a process running threads (API, hasher pool) isn't safe
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        chunksize = max(1, len(passwords) // (processes * 4))
+        return list(pool.map(get_password_hash, passwords, chunksize=chunksize))
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashing operations waiting for a worker"""
+
+
+class PasswordHasherPool:
+    """Runs bcrypt on a dedicated thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL, so `workers` threads hash in parallel. At most
+    `workers` hashes run at once (concurrency cap), the rest wait in the pool
+    queue and once `max_queue` are waiting new calls fail fast with
+    `PasswordHasherBusy` instead of piling up (0 means unbounded).
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0  # only touched from the event loop thread
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="dundie-pwd-hash"
+            )
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls waiting for a free worker"""
+        return max(0, self.pending - self.workers)
+
+    def _publish(self, pending: int):
+        """Moves the Prometheus gauges by the change of `pending` (the gauges
+        sum every pool of every worker process).
+        """
+        before_in_progress, before_queued = min(self.pending, self.workers), self.queue_depth
+        self.pending = pending
+        PASSWORD_HASHER_IN_PROGRESS.inc(min(self.pending, self.workers) - before_in_progress)
+        PASSWORD_HASHER_QUEUE_DEPTH.inc(self.queue_depth - before_queued)
+
+    async def run(self, func, *args):
+        if self.max_queue and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            PASSWORD_HASHER_REJECTED.inc()
+            raise PasswordHasherBusy("Too many password operations in progress")
+        self._publish(self.pending + 1)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self._publish(self.pending - 1)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_progress": min(self.pending, self.workers),
+            "queue_depth": self.queue_depth,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+pwd_hasher = PasswordHasherPool(
+    workers=settings.security.pwd_hash_workers,
+    max_queue=settings.security.pwd_hash_max_queue,
+)
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    """Awaitable verify_password running on the password hasher pool"""
+    return await pwd_hasher.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password) -> "HashedPassword":
+    """Awaitable get_password_hash running on the password hasher pool"""
+    return HashedPassword(await pwd_hasher.run(get_password_hash, password))
 
 
 class HashedPassword(str):
@@ -20,6 +147,9 @@ class HashedPassword(str):
     class User(SQLModel, table=True):
         username: str
         password: HashedPassword
+
+    Values that are already a HashedPassword (e.g: from get_password_hash_async)
+    are kept as they are.
     """
 
     @classmethod
@@ -32,6 +162,9 @@ class HashedPassword(str):
     @classmethod
     def validate(cls, v):
         """Accepts a plain text password and returns a hashed password."""
+        if isinstance(v, HashedPassword):
+            return v
+
         if not isinstance(v, str):
             raise TypeError("string required")
 
@@ -40,4 +173,4 @@ class HashedPassword(str):
         # would be a string, pydantic won't care but you could end up with some
         # confusion since the value's type won't match the type annotation
         # exactly
-        return cls(hashed_password)
\ No newline at end of file
+        return cls(hashed_password)
@@ -0,0 +1,289 @@
+"""Outbound email delivery.
+
+Messages are queued on the `emailoutbox` table (`enqueue_email`) and
+delivered in batches by an OutboxWorker, reusing one SMTP connection.
+"""
+import asyncio
+import logging
+import random
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from dundie.config import settings
+from dundie.db import get_engine
+from dundie.models import EmailOutbox
+
+# Max wait between polls while batches keep failing (e.g: database down)
+MAX_ERROR_BACKOFF_SECONDS = 300
+
+logger = logging.getLogger("dundie.email")
+
+
+def enqueue_email(
+    email: str, message: str, session: Optional[Session] = None
+) -> EmailOutbox:
+    """Queues `message` for `email`, it is sent by the next worker poll.
+
+    Commits on the caller `session`, or on a session of its own (closed
+    before returning) when none is given.
+    """
+    if session is None:
+        with Session(get_engine()) as session:
+            return enqueue_email(email, message, session)
+    outbox = EmailOutbox(to=email, message=message)
+    session.add(outbox)
+    session.commit()
+    session.refresh(outbox)
+    return outbox
+
+
+class SMTPSender:
+    """Keeps one (authenticated) SMTP connection open across messages.
+
+    The connection is opened on the first message and reopened once if the
+    server dropped it since the previous one.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        ssl: bool = True,
+        timeout: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.ssl = ssl
+        self.timeout = timeout
+        self.connections = 0
+        self._server: Optional[smtplib.SMTP] = None
+
+    def connect(self) -> smtplib.SMTP:
+        if self._server is None:
+            smtp_class = smtplib.SMTP_SSL if self.ssl else smtplib.SMTP
+            server = smtp_class(self.host, self.port, timeout=self.timeout)
+            if self.user:
+                server.login(self.user, self.password)
+            self._server = server
+            self.connections += 1
+        return self._server
+
+    def send(self, sender: str, to: str, message: str):
+        try:
+            self.connect().sendmail(sender, to, message.encode("utf8"))
+        except smtplib.SMTPServerDisconnected:
+            self._server = None
+            self.connect().sendmail(sender, to, message.encode("utf8"))
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            raise  # the server answered, the connection is still usable
+        except OSError:
+            self._server = None
+            raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            self._server = None
+
+
+class DebugSender:
+    """Appends messages to a file instead of sending them"""
+
+    def __init__(self, path: str = "email.log"):
+        self.path = path
+
+    def send(self, sender: str, to: str, message: str):
+        with open(self.path, "a") as f:
+            f.write(f"--- START EMAIL {to} ---\n" f"{message}\n" "--- END OF EMAIL ---\n")
+
+    def close(self):
+        pass
+
+
+def get_sender():
+    """Sender configured on `[email]` settings"""
+    if settings.email.debug_mode is True:  # pyright: ignore
+        return DebugSender()
+    return SMTPSender(
+        settings.email.smtp_server,  # pyright: ignore
+        settings.email.smtp_port,  # pyright: ignore
+        user=settings.email.smtp_user if settings.email.smtp_auth else None,  # pyright: ignore
+        password=settings.email.smtp_password,  # pyright: ignore
+        ssl=settings.email.smtp_ssl,  # pyright: ignore
+        timeout=settings.email.smtp_timeout,  # pyright: ignore
+    )
+
+
+def _is_permanent(error: Exception) -> bool:
+    """5xx replies (e.g: unknown recipient) won't succeed on retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class OutboxWorker:
+    """Delivers due outbox messages in batches through a single sender.
+
+    Messages are claimed with a conditional UPDATE (a lease on
+    `next_attempt_at`) so many workers can poll the same outbox. Failures
+    are retried with jittered exponential backoff up to `max_attempts`,
+    5xx replies fail at once. At most `rate_per_second` messages are sent.
+    """
+
+    def __init__(
+        self,
+        sender=None,
+        batch_size: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        rate_per_second: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+    ):
+        email = settings.email
+        self.sender = sender or get_sender()
+        self.batch_size = batch_size or email.outbox_batch_size
+        self.max_attempts = max_attempts or email.outbox_max_attempts
+        self.backoff_seconds = (
+            email.outbox_backoff_seconds if backoff_seconds is None else backoff_seconds
+        )
+        self.rate_per_second = (
+            email.outbox_rate_per_second if rate_per_second is None else rate_per_second
+        )
+        self.lease_seconds = lease_seconds or email.outbox_lease_seconds
+        self._last_send = 0.0
+
+    def _claim(self, session: Session) -> list[EmailOutbox]:
+        now = datetime.utcnow()
+        due = session.exec(
+            select(EmailOutbox.id, EmailOutbox.next_attempt_at)
+            .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+            .limit(self.batch_size)
+        ).all()
+        table = EmailOutbox.__table__
+        lease = now + timedelta(seconds=self.lease_seconds)
+        claimed = [
+            id_
+            for id_, next_attempt_at in due
+            if session.execute(
+                update(table)
+                .where(table.c.id == id_, table.c.next_attempt_at == next_attempt_at)
+                .values(next_attempt_at=lease)
+            ).rowcount
+        ]
+        session.commit()
+        if not claimed:
+            return []
+        return session.exec(
+            select(EmailOutbox).where(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id)
+        ).all()
+
+    def _throttle(self):
+        if self.rate_per_second:
+            wait = self._last_send + 1 / self.rate_per_second - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        self._last_send = time.monotonic()
+
+    def run_once(self) -> dict:
+        """Sends one batch, returns the number of `sent`, `retried` and `failed`"""
+        result = {"sent": 0, "retried": 0, "failed": 0}
+        sender_address = settings.email.smtp_sender  # pyright: ignore
+        # messages are committed one by one, keep the rest of the batch loaded
+        with Session(get_engine(), expire_on_commit=False) as session:
+            for message in self._claim(session):
+                self._throttle()
+                message.attempts += 1
+                try:
+                    self.sender.send(sender_address, message.to, message.message)
+                except OSError as e:  # smtplib errors included
+                    message.last_error = str(e)[:500]
+                    if _is_permanent(e) or message.attempts >= self.max_attempts:
+                        message.status = "failed"
+                        result["failed"] += 1
+                    else:
+                        delay = self.backoff_seconds * 2 ** (message.attempts - 1)
+                        message.next_attempt_at = datetime.utcnow() + timedelta(
+                            seconds=random.uniform(delay / 2, delay)
+                        )
+                        result["retried"] += 1
+                else:
+                    message.status = "sent"
+                    message.sent_at = datetime.utcnow()
+                    result["sent"] += 1
+                session.add(message)
+                session.commit()
+        return result
+
+    def _next_wait(self, poll_seconds: float, result: dict) -> float:
+        """No wait after a full batch, there may be more messages due"""
+        return 0 if sum(result.values()) >= self.batch_size else poll_seconds
+
+    @staticmethod
+    def _error_wait(poll_seconds: float, failures: int) -> float:
+        """Logs the failed batch, the wait grows while batches keep failing"""
+        wait = min(poll_seconds * 2 ** (failures - 1), MAX_ERROR_BACKOFF_SECONDS)
+        logger.exception("Email outbox batch failed, next attempt in %.0fs", wait)
+        return wait
+
+    def run(self, poll_seconds: Optional[float] = None, stop: Optional[threading.Event] = None):
+        """Polls the outbox until `stop` is set, draining full batches at once.
+
+        A failing batch is logged and retried with backoff, the loop only
+        ends on `stop`.
+        """
+        poll_seconds = poll_seconds or settings.email.outbox_poll_seconds
+        stop = stop or threading.Event()
+        failures = 0
+        try:
+            while not stop.is_set():
+                try:
+                    result = self.run_once()
+                except Exception:
+                    failures += 1
+                    wait = self._error_wait(poll_seconds, failures)
+                else:
+                    failures = 0
+                    wait = self._next_wait(poll_seconds, result)
+                if wait:
+                    stop.wait(wait)
+        finally:
+            self.sender.close()
+
+    async def run_async(
+        self, poll_seconds: Optional[float] = None, stop: Optional[asyncio.Event] = None
+    ):
+        """`run` for an event loop: each batch runs on a thread"""
+        poll_seconds = poll_seconds or settings.email.outbox_poll_seconds
+        stop = stop or asyncio.Event()
+        failures = 0
+        try:
+            while not stop.is_set():
+                try:
+                    result = await asyncio.to_thread(self.run_once)
+                except Exception:
+                    failures += 1
+                    wait = self._error_wait(poll_seconds, failures)
+                else:
+                    failures = 0
+                    wait = self._next_wait(poll_seconds, result)
+                if wait:
+                    try:
+                        await asyncio.wait_for(stop.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await asyncio.to_thread(self.sender.close)
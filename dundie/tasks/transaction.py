@@ -1,48 +1,561 @@
+import asyncio
+import csv
+import json
+import random
+import time
+from datetime import datetime
+from pathlib import Path
 from typing import Optional
-from sqlmodel import Session, select
-from dundie.db import engine
-from dundie.models import User, Transaction, Balance
+from sqlalchemy import bindparam, insert, literal, union_all, update
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlmodel import Session, select, func, delete
+from dundie.config import settings
+from dundie.db import get_engine
+from dundie.leaderboard import leaderboard
+from dundie.metrics import TRANSACTION_ERRORS, record_transactions
+from dundie.models import (
+    User,
+    Transaction,
+    TransactionArchive,
+    Balance,
+    LedgerOpening,
+    LedgerSummary,
+)
+
+# Max bound parameters per statement on bulk operations
+CHUNK_SIZE = 5000
+TRANSACTION_RETRIES = settings.db.transaction_retries
+# serialization_failure, deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+TRANSACTION_COLUMNS = ["id", "user_id", "from_id", "value", "date"]
 
 
 class TransactionError(Exception):
     """Can't add transaction"""
 
 
+class TransientTransactionError(Exception):
+    """A concurrent transaction got in the way (serialization failure,
+    deadlock, same balance/summary row inserted first), retry the whole unit.
+    """
+
+
+class TransactionBatchError(TransactionError):
+    """Can't add a batch of transactions, `errors` lists the failing items"""
+
+    def __init__(self, errors: list[dict]):
+        self.errors = errors
+        super().__init__(f"{len(errors)} item(s) failed, no transaction was added")
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _sqlstate(error: DBAPIError) -> Optional[str]:
+    return getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Serialization failures, deadlocks, busy sqlite and balance insert races.
+
+    Decided by SQLSTATE: asyncpg reports deadlocks and serialization
+    failures as a plain DBAPIError, psycopg2 as an OperationalError.
+    """
+    if isinstance(error, TransientTransactionError):
+        return True
+    if isinstance(error, DBAPIError):
+        return _sqlstate(error) in RETRYABLE_SQLSTATES or "database is locked" in str(error.orig)
+    return False
+
+
+def _backoff(attempt: int) -> float:
+    """Jittered exponential backoff (seconds) before retry number `attempt`"""
+    return random.uniform(0, 0.01 * 2 ** attempt)
+
+
+def _insert_missing(session: Session, table, rows: list[dict]):
+    """Inserts rows found missing, a concurrent transfer inserting the same
+    key first raises TransientTransactionError (other violations propagate).
+    """
+    for chunk in _chunks(rows):
+        try:
+            session.execute(insert(table), chunk)
+        except IntegrityError as e:
+            if _sqlstate(e) == "23505" or "UNIQUE constraint failed" in str(e.orig):
+                raise TransientTransactionError(str(e.orig)) from e
+            raise
+
+
+def _commit_with_retry(session: Session, post, retries: int = TRANSACTION_RETRIES):
+    """Runs `post()` and commits, retrying the whole unit on transient errors.
+
+    Retries up to `retries` times with jittered exponential backoff, the
+    session is rolled back before each attempt. Returns the result of the
+    committed `post()`. Once retries are exhausted (at once with retries=0,
+    see run_transaction_async) TransientTransactionError is raised.
+    """
+    for attempt in range(1, retries + 2):
+        try:
+            result = post()
+            session.commit()
+            return result
+        except (DBAPIError, TransientTransactionError) as e:
+            session.rollback()
+            if not _is_retryable(e):
+                raise
+            if attempt > retries:
+                if isinstance(e, TransientTransactionError):
+                    raise
+                raise TransientTransactionError(str(e.orig)) from e
+            time.sleep(_backoff(attempt))
+
+
+async def run_transaction_async(session, func):
+    """Runs the sync `func(sync_session)` with `AsyncSession.run_sync`,
+    retrying TransientTransactionError up to `db.transaction_retries` times.
+
+    run_sync executes on the event loop thread, so `func` must not sleep:
+    call add_transaction/add_transactions_batch with `retry=False` and the
+    backoff is awaited here.
+    """
+    for attempt in range(1, TRANSACTION_RETRIES + 2):
+        try:
+            return await session.run_sync(func)
+        except TransientTransactionError:
+            if attempt > TRANSACTION_RETRIES:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+
+
+def _apply_balance_deltas(
+    session: Session, from_user: User, deltas: dict[int, int]
+) -> dict[int, tuple[int, int]]:
+    """Applies `deltas` with atomic `UPDATE balance SET value = value + :delta`.
+
+    Rows are updated in user_id order so concurrent transfers always lock
+    them in the same order (no deadlocks). The sender is debited with a
+    conditional update (`WHERE value >= :total`) unless it is a superuser,
+    so concurrent transfers can never overspend.
+
+    Returns the `user_id -> (balance, version)` written, read back while
+    the rows are still locked by this transaction.
+    """
+    now = datetime.utcnow()
+    table = Balance.__table__
+    user_ids = sorted(deltas)
+
+    existing = set()
+    for chunk in _chunks(user_ids):
+        existing.update(
+            session.exec(select(Balance.user_id).where(Balance.user_id.in_(chunk))).all()
+        )
+    missing = [
+        {"user_id": user_id, "value": 0, "updated_at": now}
+        for user_id in user_ids
+        if user_id not in existing
+    ]
+    _insert_missing(session, table, missing)
+
+    credit = (
+        update(table)
+        .where(table.c.user_id == bindparam("id"))
+        .values(value=table.c.value + bindparam("delta"), updated_at=now)
+    )
+    before = [{"id": i, "delta": deltas[i]} for i in user_ids if i < from_user.id]
+    after = [{"id": i, "delta": deltas[i]} for i in user_ids if i > from_user.id]
+
+    for chunk in _chunks(before):
+        session.execute(credit, chunk)
+
+    debit = -deltas[from_user.id]
+    query = (
+        update(table)
+        .where(table.c.user_id == from_user.id)
+        .values(value=table.c.value - debit, updated_at=now)
+    )
+    if not from_user.superuser:
+        query = query.where(table.c.value >= debit)
+    if session.execute(query).rowcount == 0:
+        raise TransactionError("Insufficient balance")
+
+    for chunk in _chunks(after):
+        session.execute(credit, chunk)
+
+    balances = {}
+    for chunk in _chunks(user_ids):
+        query = select(Balance.user_id, Balance.value, Balance.version).where(
+            Balance.user_id.in_(chunk)
+        )
+        balances.update(
+            (user_id, (value, version)) for user_id, value, version in session.exec(query)
+        )
+    return balances
+
+
+def _apply_ledger_summary(
+    session: Session, from_user: User, items: list[tuple[int, int]], day
+):
+    """Adds `items` to the daily income/expense rollups of `day`.
+
+    Same approach as the balances: missing rows are inserted, then updated
+    with atomic increments in (user_id, direction) order.
+    """
+    totals: dict[tuple[int, str], list[int]] = {}
+    for user_id, value in items:
+        income = totals.setdefault((user_id, "income"), [0, 0])
+        income[0] += value
+        income[1] += 1
+    expense = totals.setdefault((from_user.id, "expense"), [0, 0])
+    expense[0] += sum(value for _, value in items)
+    expense[1] += len(items)
+
+    keys = sorted(totals)
+    existing = set()
+    for chunk in _chunks(sorted({user_id for user_id, _ in keys})):
+        query = select(LedgerSummary.user_id, LedgerSummary.direction).where(
+            LedgerSummary.day == day, LedgerSummary.user_id.in_(chunk)
+        )
+        existing.update(session.exec(query).all())
+    missing = [
+        {"user_id": user_id, "day": day, "direction": direction, "value": 0, "transactions": 0}
+        for user_id, direction in keys
+        if (user_id, direction) not in existing
+    ]
+    table = LedgerSummary.__table__
+    _insert_missing(session, table, missing)
+
+    increment = (
+        update(table)
+        .where(
+            table.c.user_id == bindparam("uid"),
+            table.c.day == bindparam("d"),
+            table.c.direction == bindparam("dir"),
+        )
+        .values(
+            value=table.c.value + bindparam("v"),
+            transactions=table.c.transactions + bindparam("n"),
+        )
+    )
+    params = [
+        {"uid": user_id, "d": day, "dir": direction, "v": value, "n": count}
+        for (user_id, direction), (value, count) in ((key, totals[key]) for key in keys)
+    ]
+    for chunk in _chunks(params):
+        session.execute(increment, chunk)
+
+
+def _post_transactions(
+    session: Session, from_user: User, items: list[tuple[int, int]]
+) -> dict[int, int]:
+    """Inserts a transaction from `from_user` for each `(user_id, value)` item
+    and applies the aggregated deltas to the balances, the caller commits.
+
+    Returns the `user_id -> (balance, version)` of the updated balances.
+    """
+    # Aplica o delta nos saldos em vez de re-somar todo o historico
+    total = sum(value for _, value in items)
+    deltas = {from_user.id: -total}
+    for user_id, value in items:
+        deltas[user_id] = deltas.get(user_id, 0) + value
+
+    balances = _apply_balance_deltas(session, from_user, deltas)
+
+    date = datetime.utcnow()
+    rows = [
+        {"user_id": user_id, "from_id": from_user.id, "value": value, "date": date}
+        for user_id, value in items
+    ]
+    for chunk in _chunks(rows):
+        session.execute(insert(Transaction.__table__), chunk)
+
+    _apply_ledger_summary(session, from_user, items, date.date())
+    return balances
+
+
 def add_transaction(
     *,
     user: User,
     from_user: User,
     value: int,
-    session: Optional[Session] = None
+    session: Optional[Session] = None,
+    retry: bool = True,
 ):
     """Adds a new transaction to the specified user.
-    
-    params: 
+
+    params:
         user: The user to add transaction to.
         from_user: The user where amount is coming from os superuser.
         value: The value being added
+        retry: Retry transient errors here (sleeping between attempts),
+            async callers pass False and use run_transaction_async.
+
+    Raises TransactionError if `value` is not positive.
     """
-    
-    session = session or Session(engine)
+    if value <= 0:
+        TRANSACTION_ERRORS.labels("single").inc()
+        raise TransactionError("Value must be positive")
+
+    session = session or Session(get_engine())
 
     # TODO: Está dando erro quando usa o from_user pq a opracao com lay field diz q
     # o objeto está desconectado da sessão. O que não faz sentido.
     from_user = session.exec(select(User).where(User.id==from_user.id)).first()
 
-    if not from_user.superuser and from_user.balance < value:
-        raise TransactionError("Insufficient balance")
-    
-    transaction = Transaction(user=user, from_user=from_user, value=value)
-    session.add(transaction)
-    session.commit()  # HERE BE THE DRAGONS!!!
+    try:
+        # transaction + both balances in a single commit
+        balances = _commit_with_retry(
+            session,
+            lambda: _post_transactions(session, from_user, [(user.id, value)]),
+            retries=TRANSACTION_RETRIES if retry else 0,
+        )
+    except TransactionError:
+        session.rollback()
+        TRANSACTION_ERRORS.labels("single").inc()
+        raise
+    leaderboard.apply_balances(balances)
+    record_transactions(1, value)
     session.refresh(user)
     session.refresh(from_user)
 
-    for holder in (user, from_user):
-        total_income = sum([t.value for t in holder.incomes])
-        total_expense = sum([t.value for t in holder.expenses])
-        balance = session.get(Balance, holder.id) or Balance(user=holder, value=0)
-        balance.value = total_income - total_expense
-        session.add(balance)
 
-    session.commit()
\ No newline at end of file
+def add_transactions_batch(
+    *,
+    items: list[tuple[str, int]],
+    from_user: User,
+    session: Optional[Session] = None,
+    retry: bool = True,
+) -> dict:
+    """Adds a transaction from `from_user` to each `(username, value)` item.
+
+    All or nothing: usernames are resolved at once, the sender balance is
+    checked once against the total and all transactions and balance deltas
+    are written in a single commit. Raises TransactionBatchError listing
+    every failing item. `retry` as in add_transaction.
+    """
+    session = session or Session(get_engine())
+    from_user = session.exec(select(User).where(User.id == from_user.id)).first()
+
+    usernames = sorted({username for username, _ in items})
+    user_ids = {}
+    for chunk in _chunks(usernames):
+        query = select(User.username, User.id).where(User.username.in_(chunk))
+        user_ids.update(session.exec(query).all())
+
+    errors = []
+    for index, (username, value) in enumerate(items):
+        if username not in user_ids:
+            errors.append({"index": index, "username": username, "error": "User not found"})
+        elif value <= 0:
+            errors.append({"index": index, "username": username, "error": "Value must be positive"})
+    if not items:
+        errors.append({"index": None, "username": None, "error": "No items"})
+    if errors:
+        TRANSACTION_ERRORS.labels("batch").inc()
+        raise TransactionBatchError(errors)
+
+    total = sum(value for _, value in items)
+    try:
+        balances = _commit_with_retry(
+            session,
+            lambda: _post_transactions(
+                session, from_user, [(user_ids[username], value) for username, value in items]
+            ),
+            retries=TRANSACTION_RETRIES if retry else 0,
+        )
+    except TransactionError as e:
+        session.rollback()
+        TRANSACTION_ERRORS.labels("batch").inc()
+        raise TransactionBatchError(
+            [{"index": None, "username": from_user.username, "error": str(e)}]
+        )
+    leaderboard.apply_balances(balances)
+    record_transactions(len(items), total)
+    return {"count": len(items), "total": total}
+
+
+def _parse_item(row) -> tuple[str, int]:
+    """`(username, value)` of a file row, ValueError describes a malformed one"""
+    if not isinstance(row, dict):
+        raise ValueError("expected an object with username and value")
+    username, value = row.get("username"), row.get("value")
+    if not username:
+        raise ValueError("missing username")
+    if value is None or value == "":
+        raise ValueError("missing value")
+    try:
+        return username, int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"value {value!r} is not an integer")
+
+
+def load_transaction_items(path: Path) -> list[tuple[str, int]]:
+    """Reads `(username, value)` items from a .csv (with header) or .jsonl file.
+
+    Raises TransactionBatchError listing every malformed row with its line.
+    """
+    items, errors = [], []
+    with open(path, newline="") as f:
+        if path.suffix == ".jsonl":
+            rows = ((number, line) for number, line in enumerate(f, 1) if line.strip())
+        else:
+            reader = csv.DictReader(f)
+            rows = ((reader.line_num, row) for row in reader)
+        for index, (line, row) in enumerate(rows):
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                items.append(_parse_item(row))
+            except ValueError as e:
+                username = row.get("username") if isinstance(row, dict) else None
+                errors.append({"index": index, "username": username, "error": f"line {line}: {e}"})
+    if errors:
+        raise TransactionBatchError(errors)
+    return items
+
+
+def _ledger_rows(*models):
+    """UNION ALL subquery of the transaction columns of `models` tables"""
+    return union_all(
+        *(select(*(model.__table__.c[name] for name in TRANSACTION_COLUMNS)) for model in models)
+    ).subquery()
+
+
+def _movements(model, *where):
+    """Subquery of `(user_id, value)` signed movements (income +, expense -)"""
+    return (
+        select(
+            model.user_id.label("user_id"),
+            model.value.label("value"),
+        )
+        .where(*where)
+        .union_all(
+            select(
+                model.from_id.label("user_id"),
+                (-model.value).label("value"),
+            ).where(*where)
+        )
+        .subquery()
+    )
+
+
+def rebuild_ledger_summary(session: Session) -> int:
+    """Recomputes the whole ledger_summary table from `transaction` and
+    `transactionarchive`.
+
+    Returns the number of summary rows written.
+    """
+    session.execute(delete(LedgerSummary))
+    ledger = _ledger_rows(Transaction, TransactionArchive)
+    columns = ["user_id", "day", "direction", "value", "transactions"]
+    for user_column, direction in (
+        (ledger.c.user_id, "income"),
+        (ledger.c.from_id, "expense"),
+    ):
+        day = func.date(ledger.c.date)
+        query = select(
+            user_column,
+            day,
+            literal(direction),
+            func.sum(ledger.c.value),
+            func.count(ledger.c.id),
+        ).group_by(user_column, day)
+        session.execute(insert(LedgerSummary.__table__).from_select(columns, query))
+    session.commit()
+    return session.exec(select(func.count()).select_from(LedgerSummary)).one()
+
+
+def reconcile_balances(session: Session, fix: bool = False) -> list[dict]:
+    """Recomputes balances from the ledger and returns the drifted ones.
+
+    The ledger totals are the opening balances of the archived transactions
+    plus a single GROUP BY over `transaction`.
+    Each drift is a dict with `user_id`, `balance` (stored) and `ledger`.
+    If `fix` is True the stored balances are overwritten with ledger values.
+    """
+    movements = _movements(Transaction)
+    ledger_query = select(
+        movements.c.user_id, func.sum(movements.c.value)
+    ).group_by(movements.c.user_id)
+    ledger = {user_id: total or 0 for user_id, total in session.exec(ledger_query)}
+    for user_id, opening in session.exec(select(LedgerOpening.user_id, LedgerOpening.value)):
+        ledger[user_id] = ledger.get(user_id, 0) + opening
+    stored = {balance.user_id: balance for balance in session.exec(select(Balance))}
+
+    drifts = []
+    for user_id in sorted(set(ledger) | set(stored)):
+        expected = ledger.get(user_id, 0)
+        balance = stored.get(user_id)
+        current = balance.value if balance else 0
+        if balance is not None and current == expected:
+            continue
+        if balance is None and expected == 0:
+            continue
+        drifts.append({"user_id": user_id, "balance": current, "ledger": expected})
+        if fix:
+            balance = balance or Balance(user_id=user_id, value=0)
+            balance.value = expected
+            session.add(balance)
+
+    if fix:
+        session.commit()
+        leaderboard.invalidate()
+    return drifts
+
+
+def archive_ledger(session: Session, before: datetime) -> dict:
+    """Moves the transactions older than `before` to `transactionarchive`.
+
+    The net points of the moved transactions are added to the LedgerOpening
+    row of each user, so opening balance + live ledger still match Balance.
+    Everything happens in a single commit. Returns the number of archived
+    `transactions` and of `users` with a new opening balance.
+    """
+    old = Transaction.date < before
+    movements = _movements(Transaction, old)
+    nets = dict(
+        session.exec(
+            select(movements.c.user_id, func.sum(movements.c.value)).group_by(
+                movements.c.user_id
+            )
+        ).all()
+    )
+    if not nets:
+        return {"transactions": 0, "users": 0}
+    count = session.exec(select(func.count()).select_from(Transaction).where(old)).one()
+
+    user_ids = sorted(nets)
+    existing = set()
+    for chunk in _chunks(user_ids):
+        existing.update(
+            session.exec(
+                select(LedgerOpening.user_id).where(LedgerOpening.user_id.in_(chunk))
+            ).all()
+        )
+    table = LedgerOpening.__table__
+    missing = [
+        {"user_id": user_id, "value": 0, "until": before}
+        for user_id in user_ids
+        if user_id not in existing
+    ]
+    for chunk in _chunks(missing):
+        session.execute(insert(table), chunk)
+    increment = (
+        update(table)
+        .where(table.c.user_id == bindparam("uid"))
+        .values(value=table.c.value + bindparam("v"), until=before)
+    )
+    for chunk in _chunks([{"uid": user_id, "v": nets[user_id]} for user_id in user_ids]):
+        session.execute(increment, chunk)
+
+    live = Transaction.__table__
+    session.execute(
+        insert(TransactionArchive.__table__).from_select(
+            TRANSACTION_COLUMNS,
+            select(*(live.c[name] for name in TRANSACTION_COLUMNS)).where(old),
+        )
+    )
+    session.execute(delete(Transaction).where(old))
+    session.commit()
+    return {"transactions": count, "users": len(nets)}
@@ -1,40 +1,26 @@
-import smtplib
+import csv
+import json
+import time
 from datetime import timedelta
-from time import sleep
+from pathlib import Path
+from typing import Optional
 
+from pydantic import ValidationError
+from sqlalchemy import insert
 from sqlmodel import Session, select
 
 from dundie.auth import create_access_token
 from dundie.config import settings
-from dundie.db import engine
-from dundie.models.user import User
-
-
-def send_email(email: str, message: str):
-    if settings.email.debug_mode is True:  # pyright: ignore
-        _send_email_debug(email, message)
-    else:
-        _send_email_smtp(email, message)
-
-
-def _send_email_debug(email: str, message: str):
-    """Mock email sending by printing to a file"""
-    with open("email.log", "a") as f:
-        sleep(3)  # pretend it takes 3 seconds
-        f.write(f"--- START EMAIL {email} ---\n" f"{message}\n" "--- END OF EMAIL ---\n")
-
-
-def _send_email_smtp(email: str, message: str):
-    """Connect to SMTP server and send email"""
-    with smtplib.SMTP_SSL(
-        settings.email.smtp_server, settings.email.smtp_port  # pyright: ignore  # pyright: ignore
-    ) as server:
-        server.login(settings.email.smtp_user, settings.email.smtp_password)  # pyright: ignore
-        server.sendmail(
-            settings.email.smtp_sender,  # pyright: ignore
-            email,
-            message.encode("utf8"),
-        )
+from dundie.db import get_engine
+from dundie.models.user import User, UserRequest
+from dundie.security import hash_passwords, password_fingerprint
+from dundie.tasks.email import enqueue_email
+from dundie.tasks.transaction import _chunks
+
+
+def send_email(email: str, message: str, session: Optional[Session] = None):
+    """Queues the email on the outbox, see dundie.tasks.email"""
+    enqueue_email(email, message, session)
 
 
 MESSAGE = """\
@@ -50,7 +36,7 @@ This link will expire in {expire} minutes.
 
 def try_to_send_pwd_reset_email(email):
     """Given an email address sends email if user is found"""
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         user = session.exec(select(User).where(User.email == email)).first()
         if not user:
             return
@@ -60,7 +46,7 @@ def try_to_send_pwd_reset_email(email):
         expire = settings.security.RESET_TOKEN_EXPIRE_MINUTES  # pyright: ignore
 
         pwd_reset_token = create_access_token(
-            data={"sub": user.username},
+            data={"sub": user.username, "pwd": password_fingerprint(user.password)},
             expires_delta=timedelta(minutes=expire),  # pyright: ignore
             scope="pwd_reset",
         )
@@ -74,4 +60,91 @@ def try_to_send_pwd_reset_email(email):
                 pwd_reset_token=pwd_reset_token,
                 expire=expire,
             ),
+            session=session,
         )
+
+
+def load_user_rows(path: Path) -> list[dict]:
+    """Reads user rows from a .csv (with header) or .jsonl file"""
+    with open(path, newline="") as f:
+        if path.suffix == ".jsonl":
+            return [json.loads(line) for line in f if line.strip()]
+        return [
+            {key: value for key, value in row.items() if value != ""}
+            for row in csv.DictReader(f)
+        ]
+
+
+def check_new_users(session: Session, rows: list) -> tuple[list[UserRequest], list[dict]]:
+    """Validates `rows` (dicts or UserRequest) and drops usernames that exist.
+
+    Existing usernames are found with one `IN` query per CHUNK_SIZE rows.
+    Returns the users to create and an error dict (`index`, `username`,
+    `error`) for each skipped row.
+    """
+    users, errors, seen = [], [], set()
+    for index, row in enumerate(rows):
+        try:
+            user = row if isinstance(row, UserRequest) else UserRequest.parse_obj(row)
+        except ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+            )
+            username = row.get("username") or row.get("name")
+            errors.append({"index": index, "username": username, "error": error})
+            continue
+        if user.username in seen:
+            errors.append({"index": index, "username": user.username, "error": "Duplicated"})
+            continue
+        seen.add(user.username)
+        users.append((index, user))
+
+    existing = set()
+    for chunk in _chunks(sorted(seen)):
+        existing.update(session.exec(select(User.username).where(User.username.in_(chunk))))
+    for index, user in users:
+        if user.username in existing:
+            errors.append(
+                {"index": index, "username": user.username, "error": "Username already taken"}
+            )
+    errors.sort(key=lambda error: error["index"])
+    return [user for _, user in users if user.username not in existing], errors
+
+
+def insert_users(session: Session, users: list[UserRequest], hashes: list[str]) -> int:
+    """Inserts `users` with their password `hashes` (executemany per chunk)
+    in a single commit, returns the number of users created.
+    """
+    rows = [
+        {
+            **user.dict(include={"name", "email", "dept", "currency", "username", "avatar", "bio"}),
+            "password": hashed,
+        }
+        for user, hashed in zip(users, hashes)
+    ]
+    for chunk in _chunks(rows):
+        session.execute(insert(User.__table__), chunk)
+    session.commit()
+    return len(rows)
+
+
+def import_users(session: Session, rows: list, processes=None) -> dict:
+    """Creates the users of `rows`, skipping invalid rows and taken usernames.
+
+    Passwords are hashed on a process pool. Returns `created`, the `skipped`
+    errors and timings (`seconds`, `hash_seconds`, `per_second`).
+    """
+    start = time.perf_counter()
+    users, errors = check_new_users(session, rows)
+    hash_start = time.perf_counter()
+    hashes = hash_passwords([user.password for user in users], processes=processes)
+    hash_seconds = time.perf_counter() - hash_start
+    created = insert_users(session, users, hashes)
+    seconds = time.perf_counter() - start
+    return {
+        "created": created,
+        "skipped": errors,
+        "seconds": round(seconds, 3),
+        "hash_seconds": round(hash_seconds, 3),
+        "per_second": round(created / seconds, 1) if seconds else None,
+    }
@@ -39,17 +39,16 @@ def upgrade() -> None:
     sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
     sa.PrimaryKeyConstraint('id')
     )
-    op.alter_column('user', 'password',
-               existing_type=sa.VARCHAR(),
-               nullable=False)
+    # batch mode: sqlite can't ALTER COLUMN, it copies the table instead
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.VARCHAR(), nullable=False)
     # ### end Alembic commands ###
 
 
 def downgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    op.alter_column('user', 'password',
-               existing_type=sa.VARCHAR(),
-               nullable=True)
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.VARCHAR(), nullable=True)
     op.drop_table('transaction')
     op.drop_table('balance')
     # ### end Alembic commands ###
@@ -10,8 +10,7 @@ from typing import Sequence, Union
 from alembic import op
 import sqlalchemy as sa
 import sqlmodel
-from dundie.models.user import User
-from sqlmodel import Session
+from passlib.context import CryptContext
 
 
 # revision identifiers, used by Alembic.
@@ -21,24 +20,36 @@ branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
+# The user table as of this revision, later columns (e.g: version) don't exist yet
+user_table = sa.table(
+    'user',
+    sa.column('id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('username', sa.String),
+    sa.column('email', sa.String),
+    sa.column('dept', sa.String),
+    sa.column('password', sa.String),
+    sa.column('currency', sa.String),
+)
+
+
 def upgrade() -> None:
     bind = op.get_bind()
-    session = Session(bind=bind)
-
-    admin = User(
-        name="Admin",
-        username="admin",
-        email="admin@admin.com",
-        dept="management",
-        password="admin", # ler de envvars/secrets - colocar password em settings ou envvars
-        currency="USD"
-    )
-
-    try:
-        session.add(admin)
-        session.commit()
-    except sa.exc.IntegrityError:
-        session.rollback()
+    exists = bind.execute(
+        sa.select(user_table.c.id).where(user_table.c.username == 'admin')
+    ).first()
+    if exists:
+        return
+
+    op.bulk_insert(user_table, [{
+        "name": "Admin",
+        "username": "admin",
+        "email": "admin@admin.com",
+        "dept": "management",
+        # ler de envvars/secrets - colocar password em settings ou envvars
+        "password": CryptContext(schemes=["bcrypt"]).hash("admin"),
+        "currency": "USD",
+    }])
 
 
 def downgrade() -> None:
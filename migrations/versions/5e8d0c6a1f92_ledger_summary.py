@@ -0,0 +1,52 @@
+"""ledger_summary
+
+Revision ID: 5e8d0c6a1f92
+Revises: 9c1f3a2b7d4e
+Create Date: 2026-10-18 14:03:27.551092
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8d0c6a1f92'
+down_revision: Union[str, None] = '9c1f3a2b7d4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of the backfill: migrations must not depend on application code
+BACKFILL = """
+INSERT INTO ledgersummary (user_id, day, direction, value, transactions)
+SELECT {column}, date(date), '{direction}', sum(value), count(id)
+FROM "transaction"
+GROUP BY {column}, date(date)
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ledgersummary',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('direction', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.Column('transactions', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id', 'day', 'direction'),
+    )
+    op.create_index(
+        'ix_ledgersummary_direction_day', 'ledgersummary', ['direction', 'day'], unique=False
+    )
+
+    # Backfill from the existing ledger
+    for column, direction in (("user_id", "income"), ("from_id", "expense")):
+        op.execute(BACKFILL.format(column=column, direction=direction))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ledgersummary_direction_day', table_name='ledgersummary')
+    op.drop_table('ledgersummary')
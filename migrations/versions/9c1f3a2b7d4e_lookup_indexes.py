@@ -0,0 +1,38 @@
+"""lookup_indexes
+
+Revision ID: 9c1f3a2b7d4e
+Revises: 4768145d8cb3
+Create Date: 2026-10-18 10:12:44.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c1f3a2b7d4e'
+down_revision: Union[str, None] = '4768145d8cb3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # NOTE: fails if there are duplicated usernames, fix them before upgrading
+    op.create_index(op.f('ix_user_username'), 'user', ['username'], unique=True)
+    op.create_index(op.f('ix_user_email'), 'user', ['email'], unique=False)
+    op.create_index(
+        'ix_transaction_user_id_date', 'transaction', ['user_id', 'date'], unique=False
+    )
+    op.create_index(
+        'ix_transaction_from_id_date', 'transaction', ['from_id', 'date'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transaction_from_id_date', table_name='transaction')
+    op.drop_index('ix_transaction_user_id_date', table_name='transaction')
+    op.drop_index(op.f('ix_user_email'), table_name='user')
+    op.drop_index(op.f('ix_user_username'), table_name='user')
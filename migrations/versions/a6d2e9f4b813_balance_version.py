@@ -0,0 +1,29 @@
+"""balance_version
+
+Revision ID: a6d2e9f4b813
+Revises: f2c84b6e1d57
+Create Date: 2026-10-19 10:12:40.918273
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d2e9f4b813'
+down_revision: Union[str, None] = 'f2c84b6e1d57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'balance',
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('balance', 'version')
@@ -0,0 +1,61 @@
+"""transaction_archive
+
+Revision ID: b7e4d19c2a03
+Revises: 5e8d0c6a1f92
+Create Date: 2026-10-18 16:21:09.304518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4d19c2a03'
+down_revision: Union[str, None] = '5e8d0c6a1f92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'transactionarchive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('from_id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.Column('date', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['from_id'], ['user.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_transactionarchive_user_id_date',
+        'transactionarchive',
+        ['user_id', 'date'],
+        unique=False,
+    )
+    op.create_index(
+        'ix_transactionarchive_from_id_date',
+        'transactionarchive',
+        ['from_id', 'date'],
+        unique=False,
+    )
+    op.create_index('ix_transactionarchive_date', 'transactionarchive', ['date'], unique=False)
+    op.create_table(
+        'ledgeropening',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.Column('until', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('ledgeropening')
+    op.drop_index('ix_transactionarchive_date', table_name='transactionarchive')
+    op.drop_index('ix_transactionarchive_from_id_date', table_name='transactionarchive')
+    op.drop_index('ix_transactionarchive_user_id_date', table_name='transactionarchive')
+    op.drop_table('transactionarchive')
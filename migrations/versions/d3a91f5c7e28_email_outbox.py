@@ -0,0 +1,46 @@
+"""email_outbox
+
+Revision ID: d3a91f5c7e28
+Revises: b7e4d19c2a03
+Create Date: 2026-10-18 18:42:51.718233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a91f5c7e28'
+down_revision: Union[str, None] = 'b7e4d19c2a03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'emailoutbox',
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('to', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_emailoutbox_status_next_attempt_at',
+        'emailoutbox',
+        ['status', 'next_attempt_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_emailoutbox_status_next_attempt_at', table_name='emailoutbox')
+    op.drop_table('emailoutbox')
@@ -0,0 +1,29 @@
+"""user_version
+
+Revision ID: f2c84b6e1d57
+Revises: d3a91f5c7e28
+Create Date: 2026-10-18 21:07:13.402518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c84b6e1d57'
+down_revision: Union[str, None] = 'd3a91f5c7e28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'user',
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('user', 'version')
@@ -1,11 +1,16 @@
 import os
+from contextlib import contextmanager
 
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.exc import IntegrityError
 
-from dundie.app import app
-from dundie.cli import create_user
+# TestClient runs each request in a new event loop, async connections can't be reused
+os.environ.setdefault("DUNDIE_DB__async_null_pool", "true")
+
+from dundie.app import app  # noqa: E402
+from dundie.cli import create_user  # noqa: E402
+from dundie.db import count_queries  # noqa: E402
 
 os.environ["DUNDIE_DB__uri"] = "postgresql://postgres:postgres@db:5432/dundie_test"
 
@@ -66,4 +71,17 @@ def api_client_user2():
 
 @pytest.fixture(scope="function")
 def api_client_user3():
-    return create_api_client_authenticated("user3", create=False)
\ No newline at end of file
+    return create_api_client_authenticated("user3", create=False)
+
+
+@pytest.fixture
+def assert_max_queries():
+    """`with assert_max_queries(3): client.get(...)` fails on more queries"""
+    @contextmanager
+    def check(n: int):
+        with count_queries() as stats:
+            yield stats
+        statements = "\n".join(stats.statements)
+        assert stats.queries <= n, f"{stats.queries} queries (max {n}):\n{statements}"
+
+    return check
@@ -111,4 +111,456 @@ def test_regular_user_can_see_only_own_transaction(api_client_user3):
     assert transactions["total"] == 1
     assert transactions["items"][0]["value"] == 500
     assert transactions["items"][0]["user"] == "user3"
-    assert transactions["items"][0]["from_user"] == "admin"
\ No newline at end of file
+    assert transactions["items"][0]["from_user"] == "admin"
+
+
+@pytest.mark.order(7)
+def test_balances_match_the_ledger():
+    """Ensure that incremental balance updates never drift from the ledger"""
+    from sqlmodel import Session
+
+    from dundie.db import engine
+    from dundie.tasks.transaction import reconcile_balances
+
+    with Session(engine) as session:
+        assert reconcile_balances(session) == []
+
+
+@pytest.mark.order(7)
+def test_db_pool_metrics(api_client_admin, api_client_user2):
+    """Only superusers can read the connection pool metrics"""
+    assert api_client_user2.get("/metrics/db").status_code == 403
+
+    metrics = api_client_admin.get("/metrics/db").json()
+    assert set(metrics) == {"sync", "async"}
+    assert metrics["sync"]["checkouts"] > 0
+    assert sum(metrics["sync"]["wait_histogram"].values()) == metrics["sync"]["checkouts"]
+
+
+@pytest.mark.order(7)
+def test_list_transactions_by_cursor(api_client_admin):
+    """Keyset pages cover the same transactions as the offset pagination"""
+    expected = {t["id"] for t in api_client_admin.get("/transaction/").json()["items"]}
+
+    first = api_client_admin.get("/transaction/cursor/?size=3&include_total=true").json()
+    assert first["total"] == len(expected)
+    assert len(first["items"]) == 3
+    assert first["next"]
+
+    second = api_client_admin.get(f"/transaction/cursor/?size=3&cursor={first['next']}").json()
+    assert second["next"] is None
+    assert second["total"] is None
+
+    items = first["items"] + second["items"]
+    assert {t["id"] for t in items} == expected
+    dates = [t["date"] for t in items]
+    assert dates == sorted(dates, reverse=True)
+    assert all(t["user"] and t["from_user"] for t in items)
+
+    response = api_client_admin.get("/transaction/cursor/?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+@pytest.mark.order(7)
+def test_user_list_pagination_and_stream(api_client_admin):
+    """/user/ pages follow the Link header and the stream returns all users"""
+    all_users = api_client_admin.get("/user/?stream=true&show_balance=true").json()
+    assert [u["username"] for u in all_users] == ["admin", "user1", "user2", "user3"]
+    assert all(set(u.keys()) == USER_RESPONSE_WITH_BALANCE_KEYS for u in all_users)
+
+    response = api_client_admin.get("/user/?size=3")
+    assert len(response.json()) == 3
+    next_url = response.links["next"]["url"]
+
+    response = api_client_admin.get(next_url)
+    assert [u["username"] for u in response.json()] == ["user3"]
+    assert "next" not in response.links
+
+
+@pytest.mark.order(8)
+def test_transaction_batch_is_all_or_nothing(api_client_admin, api_client_user3):
+    """A batch with any failing item adds no transaction at all"""
+    before = api_client_admin.get("/transaction/").json()["total"]
+
+    response = api_client_admin.post(
+        "/transaction/batch",
+        json={"items": [{"username": "user1", "value": 10}, {"username": "ghost", "value": 10}]},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"]["errors"] == [
+        {"index": 1, "username": "ghost", "error": "User not found"}
+    ]
+
+    # user3 has 500 points, the batch total is checked at once
+    response = api_client_user3.post(
+        "/transaction/batch",
+        json={"items": [{"username": "user1", "value": 300}, {"username": "user2", "value": 300}]},
+    )
+    assert response.status_code == 400
+    assert api_client_admin.get("/transaction/").json()["total"] == before
+
+
+@pytest.mark.order(8)
+def test_transaction_batch(api_client_admin):
+    """Admin awards points to many users in a single request"""
+    balances = {
+        username: api_client_admin.get(f"/user/{username}/?show_balance=true").json()["balance"]
+        for username in ["user1", "user2", "user3"]
+    }
+    items = [{"username": username, "value": 10} for username in balances]
+    items.append({"username": "user1", "value": 5})
+
+    response = api_client_admin.post("/transaction/batch", json={"items": items})
+    assert response.status_code == 201
+    assert response.json()["count"] == 4
+    assert response.json()["total"] == 35
+
+    for username, balance in balances.items():
+        user = api_client_admin.get(f"/user/{username}/?show_balance=true").json()
+        assert user["balance"] == balance + (15 if username == "user1" else 10)
+
+
+@pytest.mark.order(9)
+def test_user_stats(api_client_user1, api_client_user2):
+    """Stats come from the ledger summary and match the balance"""
+    stats = api_client_user1.get("/user/user1/stats?since=2000-01-01").json()
+    balance = api_client_user1.get("/user/user1/?show_balance=true").json()["balance"]
+    assert stats["received"]["value"] - stats["sent"]["value"] == balance
+    assert stats["sent"] == {"value": 20, "transactions": 1}
+    assert sum(day["received"]["value"] for day in stats["daily"]) == stats["received"]["value"]
+
+    assert api_client_user2.get("/user/user1/stats").status_code == 403
+
+
+@pytest.mark.order(9)
+def test_leaderboard(api_client_user2):
+    """Top senders and receivers for the period"""
+    top_senders = api_client_user2.get("/leaderboard/?by=sent&since=2000-01-01").json()
+    assert top_senders[0]["username"] == "admin"
+
+    management = api_client_user2.get(
+        "/leaderboard/?by=received&dept=management&since=2000-01-01"
+    ).json()
+    assert [entry["username"] for entry in management] == ["user1"]
+
+
+@pytest.mark.order(9)
+def test_leaderboard_by_balance(api_client_admin, api_client_user2):
+    """The balance ranking follows transfers without reloading"""
+    def balance(username):
+        return api_client_admin.get(f"/user/{username}/?show_balance=true").json()["balance"]
+
+    top = api_client_user2.get("/leaderboard/?dept=sales").json()
+    assert [entry["value"] for entry in top] == sorted(
+        (balance(entry["username"]) for entry in top), reverse=True
+    )
+
+    leader = top[0]
+    api_client_admin.post("/transaction/user2/", json={"value": leader["value"] + 1})
+    top = api_client_user2.get("/leaderboard/?dept=sales&limit=1").json()
+    assert top == [
+        {"username": "user2", "dept": "sales", "value": balance("user2"), "transactions": None}
+    ]
+
+
+@pytest.mark.order(10)
+def test_archive_ledger(api_client_admin, api_client_user1):
+    """Archived transactions are still listed and balances still match"""
+    from datetime import datetime
+
+    from sqlmodel import Session
+
+    from dundie.db import engine
+    from dundie.tasks.transaction import archive_ledger, reconcile_balances
+
+    def ids(client, path):
+        return [t["id"] for t in client.get(path).json()["items"]]
+
+    total = api_client_admin.get("/transaction/").json()["total"]
+    listed = sorted(ids(api_client_admin, "/transaction/?size=100"))
+    user1_listed = ids(api_client_user1, "/transaction/cursor/?size=500")
+
+    horizon = datetime.utcnow()
+    with Session(engine) as session:
+        assert archive_ledger(session, horizon)["transactions"] == total
+        assert reconcile_balances(session) == []
+
+    assert sorted(ids(api_client_admin, "/transaction/?size=100")) == listed
+    assert ids(api_client_user1, "/transaction/cursor/?size=500") == user1_listed
+
+    api_client_admin.post("/transaction/user1/", json={"value": 1})
+    recent = api_client_user1.get(f"/transaction/cursor/?since={horizon.isoformat()}").json()
+    assert [t["value"] for t in recent["items"]] == [1]
+    with Session(engine) as session:
+        assert reconcile_balances(session) == []
+
+
+@pytest.mark.order(11)
+def test_user_bulk_create(api_client_admin, api_client_user2):
+    """Many users in one request, taken and repeated usernames are skipped"""
+    items = [
+        {"name": f"Bulk User {i}", "email": f"bulk{i}@dm.com", "dept": "sales", "password": "1234"}
+        for i in range(3)
+    ]
+    items.append({**items[0], "email": "again@dm.com"})
+    items.append(
+        {
+            "name": "User1",
+            "username": "user1",
+            "email": "u1@dm.com",
+            "dept": "sales",
+            "password": "1234",
+        }
+    )
+
+    response = api_client_admin.post("/user/bulk", json={"items": items})
+    assert response.status_code == 201
+    assert response.json()["created"] == 3
+    assert [(e["index"], e["username"]) for e in response.json()["skipped"]] == [
+        (3, "bulk-user-0"),
+        (4, "user1"),
+    ]
+    assert api_client_admin.get("/user/bulk-user-2/").json()["name"] == "Bulk User 2"
+
+    token = api_client_admin.post(
+        "/token",
+        data={"username": "bulk-user-1", "password": "1234"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert token.status_code == 200
+
+    assert api_client_user2.post("/user/bulk", json={"items": items}).status_code == 403
+
+
+@pytest.mark.order(12)
+def test_user_bulk_create_is_limited(api_client_admin, monkeypatch):
+    """Above security.bulk_max_items the request is refused before hashing"""
+    from dundie.config import settings
+
+    monkeypatch.setattr(settings.security, "bulk_max_items", 2)
+    items = [
+        {"name": f"Limit User {i}", "email": f"limit{i}@dm.com", "dept": "sales", "password": "1"}
+        for i in range(3)
+    ]
+    response = api_client_admin.post("/user/bulk", json={"items": items})
+    assert response.status_code == 413
+    assert "dundie import-users" in response.json()["detail"]
+    assert api_client_admin.get("/user/limit-user-0/").status_code == 404
+
+
+@pytest.mark.order(12)
+def test_query_counts(api_client_admin, api_client_user1, assert_max_queries):
+    """No N+1: query count doesn't grow with the page size"""
+    with assert_max_queries(5):  # user, archive horizon, count, page, usernames
+        assert api_client_user1.get("/transaction/?size=100").status_code == 200
+    with assert_max_queries(4):
+        assert api_client_user1.get("/transaction/cursor/?size=100").status_code == 200
+    with assert_max_queries(1):
+        assert api_client_admin.get("/user/?size=100").status_code == 200
+    with assert_max_queries(2):
+        assert api_client_admin.get("/user/user1/?show_balance=true").status_code == 200
+    with assert_max_queries(3):
+        assert api_client_user1.get("/user/user1/stats").status_code == 200
+
+
+@pytest.mark.order(12)
+def test_server_timing(api_client, caplog):
+    """Query count and DB time on the Server-Timing header and on the log"""
+    import logging
+
+    with caplog.at_level(logging.INFO, logger="dundie.requests"):
+        response = api_client.get("/user/")
+    assert 'db;dur=' in response.headers["Server-Timing"]
+    assert 'desc="1 queries"' in response.headers["Server-Timing"]
+    record = caplog.records[-1]
+    assert (record.path, record.status, record.db_queries) == ("/user/", 200, 1)
+
+
+@pytest.mark.order(12)
+def test_prometheus_metrics(api_client, api_client_admin, api_client_user2):
+    """Requests by route template, transactions and bcrypt timings on /metrics"""
+    from prometheus_client import REGISTRY
+
+    labels = {"method": "POST", "route": "/transaction/{username}/", "status": "201"}
+
+    def sample(name, labels=None):
+        return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+    requests, points = sample("dundie_http_requests_total", labels), sample(
+        "dundie_transaction_points_total"
+    )
+    response = api_client_admin.post("/transaction/user1/", json={"value": 7})
+    assert response.status_code == 201
+    assert sample("dundie_http_requests_total", labels) == requests + 1
+    assert sample("dundie_transaction_points_total") == points + 7
+
+    errors = sample("dundie_transaction_errors_total", {"kind": "single"})
+    response = api_client_user2.post("/transaction/user1/", json={"value": 10**9})
+    assert response.status_code == 400
+    assert sample("dundie_transaction_errors_total", {"kind": "single"}) == errors + 1
+
+    balance = api_client_user2.get("/user/user2/?show_balance=true").json()["balance"]
+    response = api_client_user2.post("/transaction/user1/", json={"value": -5})
+    assert response.status_code == 400
+    assert api_client_user2.get("/user/user2/?show_balance=true").json()["balance"] == balance
+
+    response = api_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'dundie_http_request_duration_seconds_bucket{le="0.005",method="POST",' \
+        'route="/transaction/{username}/"}' in response.text
+    assert sample("dundie_password_verify_seconds_count") > 0  # logins
+    assert sample("dundie_cache_lookups_total", {"cache": "token", "result": "hit"}) > 0
+
+
+@pytest.mark.order(12)
+def test_unhandled_errors_are_counted_as_500():
+    """A route raising is still counted and timed (status 500)"""
+    from fastapi.testclient import TestClient
+    from prometheus_client import REGISTRY
+
+    from dundie.app import app
+
+    def broken():
+        raise RuntimeError("boom")
+
+    app.add_api_route("/broken-for-tests", broken)
+    labels = {"method": "GET", "route": "/broken-for-tests"}
+    try:
+        response = TestClient(app, raise_server_exceptions=False).get("/broken-for-tests")
+    finally:
+        app.router.routes.pop()
+    assert response.status_code == 500
+    assert REGISTRY.get_sample_value(
+        "dundie_http_requests_total", {**labels, "status": "500"}
+    ) == 1
+    assert REGISTRY.get_sample_value("dundie_http_request_duration_seconds_count", labels) == 1
+    assert REGISTRY.get_sample_value("dundie_http_requests_in_flight") == 0
+
+
+@pytest.mark.order(12)
+def test_profiler(api_client_admin, api_client_user2):
+    """Superusers profile the worker for a while or a single request"""
+    assert api_client_user2.post("/profiler/start").status_code == 403
+
+    response = api_client_admin.post("/profiler/start?seconds=5&interval_ms=1")
+    assert response.status_code == 200
+    assert api_client_admin.post("/profiler/start").status_code == 409
+    api_client_admin.get("/user/")
+    response = api_client_admin.post("/profiler/stop?format=collapsed")
+    assert response.status_code == 200
+    assert response.text.count("\n") > 0
+
+    response = api_client_admin.get("/user/", headers={"X-Dundie-Profile": "speedscope"})
+    assert response.status_code == 200
+    assert response.headers["X-Profile-Status"] == "200"
+    assert response.json()["$schema"].startswith("https://www.speedscope.app/")
+
+    response = api_client_user2.get("/user/", headers={"X-Dundie-Profile": "speedscope"})
+    assert response.status_code == 403
+
+
+@pytest.mark.order(12)
+def test_user_etags(api_client, api_client_user1):
+    """Unchanged users answer If-None-Match with 304, updates change the ETag"""
+    response = api_client.get("/user/user1/")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"].startswith("private, max-age=")
+
+    response = api_client.get("/user/user1/", headers={"If-None-Match": etag})
+    assert (response.status_code, response.content) == (304, b"")
+    assert response.headers["ETag"] == etag
+
+    page = api_client.get("/user/?size=2")
+    page_etag = page.headers["ETag"]
+    response = api_client.get("/user/?size=2", headers={"If-None-Match": f'"other", W/{page_etag}'})
+    assert response.status_code == 304
+
+    balance = api_client_user1.get("/user/user1/?show_balance=true")
+    assert balance.headers["ETag"] != etag
+
+    api_client_user1.patch("/user/user1/", json={"avatar": None, "bio": "ETag changed"})
+    response = api_client.get("/user/user1/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["bio"] == "ETag changed"
+    assert response.headers["ETag"] != etag
+    assert api_client.get("/user/?size=2", headers={"If-None-Match": page_etag}).status_code == 200
+
+
+@pytest.mark.order(12)
+def test_balance_etag_changes_on_every_transfer(api_client_admin, api_client_user1):
+    """Each transfer bumps the balance version, so the ETag always changes"""
+    etags = [api_client_user1.get("/user/user1/?show_balance=true").headers["ETag"]]
+    for _ in range(2):
+        response = api_client_admin.post("/transaction/user1/", json={"value": 1})
+        assert response.status_code == 201
+        response = api_client_user1.get(
+            "/user/user1/?show_balance=true", headers={"If-None-Match": etags[-1]}
+        )
+        assert response.status_code == 200
+        etags.append(response.headers["ETag"])
+    assert len(set(etags)) == 3
+
+
+@pytest.mark.order(12)
+def test_transaction_metrics_never_fail_a_committed_transfer(
+    api_client_admin, api_client_user1, monkeypatch
+):
+    """A failing metric is logged, the transfer and its response stand"""
+    from dundie import metrics
+
+    def broken(amount=1):
+        raise ValueError("metric down")
+
+    monkeypatch.setattr(metrics.TRANSACTION_POINTS, "inc", broken)
+    before = api_client_user1.get("/user/user1/?show_balance=true").json()["balance"]
+    response = api_client_admin.post("/transaction/user1/", json={"value": 3})
+    assert response.status_code == 201
+    assert api_client_user1.get("/user/user1/?show_balance=true").json()["balance"] == before + 3
+
+
+@pytest.mark.order(12)
+def test_password_change_revokes_tokens(api_client):
+    """Tokens issued before a password change are rejected"""
+    from dundie.cli import create_user
+
+    create_user(name="Revoked", email="revoked@dm.com", password="old-pwd", dept="sales")
+    tokens = api_client.post(
+        "/token", data={"username": "revoked", "password": "old-pwd"}
+    ).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert api_client.get("/transaction/", headers=headers).status_code == 200
+
+    response = api_client.post(
+        "/user/revoked/password/",
+        json={"password": "new-pwd", "password_confirm": "new-pwd"},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert api_client.get("/transaction/", headers=headers).status_code == 401
+    response = api_client.post(
+        "/refresh_token", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 401
+
+    tokens = api_client.post(
+        "/token", data={"username": "revoked", "password": "new-pwd"}
+    ).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert api_client.get("/transaction/", headers=headers).status_code == 200
+
+
+def test_importing_the_app_builds_no_engine():
+    """Engines are created on first use, a bad DB uri fails there, not on import"""
+    import os
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    code = "import dundie.app; from dundie.db import _engines; assert not _engines, _engines"
+    env = {**os.environ, "DUNDIE_DB__uri": "nosuchdriver://nowhere/dundie"}
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parent.parent, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
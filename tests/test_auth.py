@@ -0,0 +1,94 @@
+import pytest
+from starlette.requests import Request
+
+from dundie import auth
+
+
+def make_request(token):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+    )
+
+
+def test_identity_is_resolved_once_per_request(monkeypatch):
+    """Repeated get_current_user calls within a request hit the cache"""
+    calls = {"decode": 0, "get_user": 0}
+    original_decode, original_get_user = auth.jwt.decode, auth.get_user
+
+    def counting_decode(*args, **kwargs):
+        calls["decode"] += 1
+        return original_decode(*args, **kwargs)
+
+    def counting_get_user(username):
+        calls["get_user"] += 1
+        return original_get_user(username)
+
+    monkeypatch.setattr(auth.jwt, "decode", counting_decode)
+    monkeypatch.setattr(auth, "get_user", counting_get_user)
+    auth.token_cache.clear()
+
+    pwd = auth.password_fingerprint(original_get_user("admin").password)
+    token = auth.create_access_token(data={"sub": "admin", "fresh": True, "pwd": pwd})
+    request = make_request(token)
+    for _ in range(3):
+        assert auth.get_current_user(token="", request=request).username == "admin"
+
+    assert calls == {"decode": 1, "get_user": 1}
+
+    # A new request reloads the user but the claims come from the token cache
+    auth.get_current_user(token="", request=make_request(token))
+    assert calls == {"decode": 1, "get_user": 2}
+
+
+def test_tokens_without_the_current_password_are_rejected():
+    """The pwd claim must match the user password (revoked on change)"""
+    for data in ({"sub": "admin"}, {"sub": "admin", "pwd": "0" * 16}):
+        token = auth.create_access_token(data=data)
+        with pytest.raises(auth.HTTPException) as error:
+            auth.get_current_user(token=token)
+        assert error.value.status_code == 401
+
+
+def test_token_cache_invalidate_user():
+    """invalidate_user evicts every cached token of that user only"""
+    cache = auth.TokenCache(maxsize=10)
+    admin_token = auth.create_access_token(data={"sub": "admin"})
+    user1_token = auth.create_access_token(data={"sub": "user1"})
+    cache.decode(admin_token)
+    cache.decode(user1_token)
+    assert len(cache) == 2
+
+    cache.invalidate_user("admin")
+    assert len(cache) == 1
+    assert cache.decode(user1_token)["sub"] == "user1"
+
+
+def test_token_cache_is_bounded():
+    """Least recently used tokens are evicted above maxsize"""
+    cache = auth.TokenCache(maxsize=2)
+    tokens = [auth.create_access_token(data={"sub": f"user{i}"}) for i in range(3)]
+    for token in tokens:
+        cache.decode(token)
+    assert len(cache) == 2
+    assert cache._key(tokens[0]) not in cache._entries
+
+
+def test_token_cache_does_not_serve_expired_tokens(monkeypatch):
+    """Cached claims are dropped once the token exp is reached"""
+    cache = auth.TokenCache(maxsize=2)
+    token = auth.create_access_token(data={"sub": "admin"})
+    claims = cache.decode(token)
+    cache._store(cache._key(token), claims, expires_at=0)  # pretend it expired
+
+    decoded = []
+    original_decode = auth.jwt.decode
+    monkeypatch.setattr(
+        auth.jwt, "decode", lambda *a, **kw: decoded.append(a) or original_decode(*a, **kw)
+    )
+    assert cache.decode(token)["sub"] == "admin"
+    assert len(decoded) == 1
@@ -0,0 +1,132 @@
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+
+# Cold start budgets (sum of `python -X importtime` self times, microseconds)
+HELP_IMPORT_BUDGET = 600_000
+USER_LIST_IMPORT_BUDGET = 1_500_000
+
+RUN_CLI = "import sys; from dundie.cli import main; sys.argv = ['dundie', *sys.argv[1:]]; main()"
+
+
+def import_profile(*args, env=None) -> tuple[int, set]:
+    """Runs the CLI with `-X importtime`, returns (import time us, module names)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUN_CLI, *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    total, modules = 0, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        total += int(self_us)
+        modules.add(name.strip())
+    return total, modules
+
+
+def test_help_cold_start():
+    """`dundie --help` imports neither settings, models nor the db stack"""
+    total, modules = import_profile("--help")
+    for module in ("dundie.config", "dundie.db", "dundie.models", "sqlalchemy", "fastapi"):
+        assert module not in modules
+    assert total < HELP_IMPORT_BUDGET
+
+
+def test_user_list_cold_start(tmp_path):
+    """`dundie user-list` doesn't import the web stack"""
+    env = {"DUNDIE_DB__uri": f"sqlite:///{tmp_path / 'cli.db'}"}
+    setup = (
+        "from dundie.db import get_engine; from dundie.models import SQLModel; "
+        "SQLModel.metadata.create_all(get_engine())"
+    )
+    subprocess.run([sys.executable, "-c", setup], check=True, env={**os.environ, **env})
+
+    total, modules = import_profile("user-list", env=env)
+    assert "dundie.models" in modules
+    for module in ("fastapi", "starlette", "jose", "dundie.auth", "dundie.routes"):
+        assert module not in modules
+    assert total < USER_LIST_IMPORT_BUDGET
+
+
+def test_user_list_formats():
+    """csv and jsonl exports with balances and dept/limit filters"""
+    from typer.testing import CliRunner
+
+    from dundie.cli import main
+
+    runner = CliRunner()
+    result = runner.invoke(main, ["user-list", "--format", "csv", "--dept", "management"])
+    assert result.exit_code == 0, result.output
+    rows = list(csv.DictReader(io.StringIO(result.output)))
+    assert "admin" in [row["username"] for row in rows]
+    assert {row["dept"] for row in rows} == {"management"}
+
+    result = runner.invoke(main, ["user-list", "--format", "jsonl", "--limit", "2"])
+    assert result.exit_code == 0, result.output
+    users = [json.loads(line) for line in result.output.splitlines()]
+    assert len(users) == 2
+    assert set(users[0]) == {"name", "username", "dept", "email", "currency", "balance"}
+
+
+def test_import_users(tmp_path):
+    """Users of a csv file are created with hashes from a process pool"""
+    from typer.testing import CliRunner
+
+    from dundie.cli import main
+
+    path = tmp_path / "branch.csv"
+    lines = [
+        "name,email,dept,password\n",
+        *(f"Imported {i},imported{i}@dm.com,sales,pwd{i}\n" for i in range(3)),
+        "Imported 0,dup@dm.com,sales,pwd\n",
+        ",noname@dm.com,sales,pwd\n",
+    ]
+    path.write_text("".join(lines))
+    result = CliRunner().invoke(main, ["import-users", str(path), "--processes", "2"])
+    assert result.exit_code == 0, result.output
+    assert "imported 3 users" in result.output
+    assert "2 skipped" in result.output
+
+    result = CliRunner().invoke(main, ["import-users", str(path), "--processes", "2"])
+    assert "imported 0 users" in result.output
+
+    from sqlmodel import Session, select
+
+    from dundie.db import get_engine
+    from dundie.models import User
+    from dundie.security import verify_password
+
+    with Session(get_engine()) as session:
+        user = session.exec(select(User).where(User.username == "imported-2")).one()
+        assert verify_password("pwd2", user.password)
+
+
+def test_transaction_batch_reports_malformed_rows(tmp_path):
+    """Rows missing a column or with a non integer value are listed by line"""
+    from sqlmodel import Session, func, select
+    from typer.testing import CliRunner
+
+    from dundie.cli import main
+    from dundie.db import get_engine
+    from dundie.models import Transaction
+
+    path = tmp_path / "awards.csv"
+    path.write_text("username,value\nuser1,10\nuser2,ten\nuser3\n")
+    with Session(get_engine()) as session:
+        before = session.exec(select(func.count(Transaction.id))).one()
+
+    result = CliRunner().invoke(main, ["transaction-batch", str(path)])
+    assert result.exit_code == 1
+    assert "2 item(s) failed" in result.output
+    assert "line 3" in result.output
+    assert "line 4" in result.output
+    assert "Traceback" not in result.output
+    with Session(get_engine()) as session:
+        assert session.exec(select(func.count(Transaction.id))).one() == before
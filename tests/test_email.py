@@ -0,0 +1,211 @@
+import socket
+from datetime import datetime
+
+import pytest
+from sqlmodel import Session, delete, select
+
+from dundie.db import get_engine
+from dundie.models import EmailOutbox
+from dundie.tasks.email import OutboxWorker, SMTPSender, enqueue_email
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+
+class Handler:
+    """Local SMTP stand-in: records messages and the connection of each one"""
+
+    def __init__(self, reject: int = 0):
+        self.messages = []
+        self.sessions = set()
+        self.reject = reject  # number of messages answered with 451
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        if self.reject:
+            self.reject -= 1
+            return "451 Try again later"
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode()))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtpd():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    handler = Handler()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield handler, port
+    controller.stop()
+
+
+@pytest.fixture(autouse=True)
+def empty_outbox():
+    with Session(get_engine()) as session:
+        session.execute(delete(EmailOutbox))
+        session.commit()
+
+
+def outbox():
+    with Session(get_engine()) as session:
+        return session.exec(select(EmailOutbox).order_by(EmailOutbox.id)).all()
+
+
+def test_worker_reuses_one_connection(smtpd):
+    """A batch of messages goes through a single SMTP session"""
+    handler, port = smtpd
+    for i in range(5):
+        enqueue_email(f"user{i}@dm.com", f"Subject: hello {i}\n\nbody")
+
+    sender = SMTPSender("127.0.0.1", port, ssl=False)
+    worker = OutboxWorker(sender, rate_per_second=0)
+    assert worker.run_once() == {"sent": 5, "retried": 0, "failed": 0}
+    sender.close()
+
+    assert [rcpt for rcpt, _ in handler.messages] == [[f"user{i}@dm.com"] for i in range(5)]
+    assert len(handler.sessions) == 1 and sender.connections == 1
+    assert {message.status for message in outbox()} == {"sent"}
+    assert worker.run_once() == {"sent": 0, "retried": 0, "failed": 0}
+
+
+def test_worker_retries_with_backoff(smtpd):
+    """Temporary failures are retried later, then the message fails for good"""
+    handler, port = smtpd
+    handler.reject = 3
+    enqueue_email("user1@dm.com", "Subject: retry\n\nbody")
+
+    sender = SMTPSender("127.0.0.1", port, ssl=False)
+    worker = OutboxWorker(sender, max_attempts=3, rate_per_second=0)
+    assert worker.run_once()["retried"] == 1
+    message = outbox()[0]
+    assert message.attempts == 1 and message.next_attempt_at > datetime.utcnow()
+    assert worker.run_once()["retried"] == 0  # not due yet
+
+    def make_due():
+        with Session(get_engine()) as session:
+            session.execute(
+                EmailOutbox.__table__.update().values(next_attempt_at=datetime.utcnow())
+            )
+            session.commit()
+
+    make_due()
+    assert worker.run_once()["retried"] == 1
+    make_due()
+    assert worker.run_once()["failed"] == 1
+    sender.close()
+    assert outbox()[0].status == "failed" and "451" in outbox()[0].last_error
+
+
+def test_worker_rate_limit():
+    """No more than rate_per_second messages are sent"""
+    sent = []
+
+    class FakeSender:
+        def send(self, sender, to, message):
+            sent.append(to)
+
+        def close(self):
+            pass
+
+    for i in range(3):
+        enqueue_email(f"user{i}@dm.com", "body")
+    worker = OutboxWorker(FakeSender(), rate_per_second=20)
+    start = datetime.utcnow()
+    assert worker.run_once()["sent"] == 3
+    assert (datetime.utcnow() - start).total_seconds() >= 0.1
+    assert len(sent) == 3
+
+
+def test_worker_async(smtpd):
+    """run_async delivers from an event loop until stopped"""
+    import asyncio
+
+    handler, port = smtpd
+    enqueue_email("user1@dm.com", "Subject: async\n\nbody")
+    sender = SMTPSender("127.0.0.1", port, ssl=False)
+    worker = OutboxWorker(sender, rate_per_second=0)
+
+    async def deliver():
+        stop = asyncio.Event()
+        task = asyncio.create_task(worker.run_async(poll_seconds=0.05, stop=stop))
+        while not handler.messages:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+
+    asyncio.run(asyncio.wait_for(deliver(), 5))
+    assert outbox()[0].status == "sent"
+    assert sender._server is None  # closed when stopped
+
+
+def test_worker_survives_failing_batches(caplog):
+    """A batch error (e.g: database down) is logged and polling goes on"""
+    import asyncio
+    import logging
+    import threading
+
+    from sqlalchemy.exc import OperationalError
+
+    class FlakyWorker(OutboxWorker):
+        calls = 0
+
+        def run_once(self):
+            self.calls += 1
+            if self.calls <= 2:
+                raise OperationalError("SELECT", {}, Exception("server closed the connection"))
+            self.stop.set()
+            return {"sent": 0, "retried": 0, "failed": 0}
+
+    class FakeSender:
+        def close(self):
+            pass
+
+    with caplog.at_level(logging.ERROR, logger="dundie.email"):
+        worker = FlakyWorker(FakeSender())
+        worker.stop = threading.Event()
+        worker.run(poll_seconds=0.01, stop=worker.stop)
+    assert worker.calls == 3
+    assert len(caplog.records) == 2
+    assert caplog.records[0].exc_info is not None
+
+    async def run_async():
+        worker = FlakyWorker(FakeSender())
+        worker.stop = asyncio.Event()
+        await worker.run_async(poll_seconds=0.01, stop=worker.stop)
+        return worker.calls
+
+    assert asyncio.run(asyncio.wait_for(run_async(), 5)) == 3
+
+
+def test_pwd_reset_email_is_queued(api_client):
+    """The API only queues the email, the worker sends it"""
+    from sqlalchemy.exc import IntegrityError
+
+    from dundie.cli import create_user
+
+    try:
+        create_user(name="Reset Me", email="reset@dm.com", password="1234", dept="sales")
+    except IntegrityError:
+        pass
+
+    response = api_client.post("/user/pwd_reset_token/", json={"email": "reset@dm.com"})
+    assert response.status_code == 200
+    assert [message.to for message in outbox()] == ["reset@dm.com"]
+    assert "pwd_reset_token=" in outbox()[0].message
+
+
+def test_enqueue_email_releases_its_connection():
+    """Without a session enqueue_email checks its connection back in"""
+    from dundie.db import get_pool_status
+
+    engine = get_engine()
+    checked_out = get_pool_status(engine).get("checked_out")
+    outbox_message = enqueue_email("user1@dm.com", "body")
+    assert outbox_message.id is not None
+    assert get_pool_status(engine).get("checked_out") == checked_out
+
+    with Session(engine) as session:
+        enqueue_email("user2@dm.com", "body", session)
+        assert session.is_active
+    assert [message.to for message in outbox()] == ["user1@dm.com", "user2@dm.com"]
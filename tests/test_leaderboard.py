@@ -0,0 +1,120 @@
+from dundie.leaderboard import InMemoryLeaderboard, Leaderboard, LeaderboardBackend
+
+ENTRIES = [
+    {"user_id": 1, "username": "admin", "dept": "management", "balance": 0},
+    {"user_id": 2, "username": "jim", "dept": "sales", "balance": 300},
+    {"user_id": 3, "username": "pam", "dept": "reception", "balance": 200},
+    {"user_id": 4, "username": "dwight", "dept": "sales", "balance": 500},
+]
+
+
+class FakeBackend(LeaderboardBackend):
+    """Records what the Leaderboard asks its backend to do"""
+
+    def __init__(self, known=()):
+        self.known = set(known)
+        self.loads = []
+        self.deltas = []
+
+    def load(self, entries):
+        self.loads.append(list(entries))
+        self.known = {entry["user_id"] for entry in self.loads[-1]}
+
+    def apply_deltas(self, deltas):
+        if not set(deltas) <= self.known:
+            return False
+        self.deltas.append(deltas)
+        return True
+
+    def top(self, dept=None, limit=10):
+        return []
+
+
+def test_backends_must_implement_every_method():
+    """A backend missing a method fails when created, not on first use"""
+    import pytest
+
+    class NoTop(LeaderboardBackend):
+        def load(self, entries):
+            pass
+
+        def apply_deltas(self, deltas):
+            return True
+
+    with pytest.raises(TypeError, match="top"):
+        NoTop()
+
+
+def test_in_memory_leaderboard_top():
+    """Ranking by balance, overall and per dept, ties ordered by username"""
+    board = InMemoryLeaderboard()
+    board.load(ENTRIES)
+
+    assert [e["username"] for e in board.top(limit=3)] == ["dwight", "jim", "pam"]
+    assert board.top(dept="sales") == [
+        {"username": "dwight", "dept": "sales", "value": 500},
+        {"username": "jim", "dept": "sales", "value": 300},
+    ]
+    assert board.top(dept="accounting") == []
+
+    assert board.apply_deltas({4: -300, 2: 200, 3: 100})
+    assert [e["username"] for e in board.top()] == ["jim", "pam", "dwight", "admin"]
+    assert board.top(dept="sales", limit=1) == [{"username": "jim", "dept": "sales", "value": 500}]
+
+
+def test_in_memory_leaderboard_unknown_user():
+    """A delta for an unknown user is refused as a whole"""
+    board = InMemoryLeaderboard()
+    board.load(ENTRIES)
+    assert not board.apply_deltas({2: 10, 99: -10})
+    assert board.top(dept="sales")[1]["value"] == 300
+
+
+def test_leaderboard_reloads_when_out_of_sync():
+    """Balances are ignored before the first load and unknown users force a reload"""
+    backend = FakeBackend()
+    board = Leaderboard(backend)
+
+    board.apply_balances({1: (10, 1)})
+    assert board.stale and backend.deltas == []
+
+    board.load(ENTRIES)
+    board.apply_balances({1: (-10, 1), 2: (310, 1)})
+    assert not board.stale and backend.deltas == [{1: -10, 2: 10}]
+
+    # an older (or already applied) version changes nothing
+    board.apply_balances({2: (305, 1)})
+    assert backend.deltas == [{1: -10, 2: 10}]
+
+    board.apply_balances({1: (-20, 2), 5: (10, 1)})
+    assert board.stale
+
+
+def test_leaderboard_replays_balances_reported_while_loading():
+    """Transfers committed during a reload are neither lost nor counted twice"""
+    board = Leaderboard(InMemoryLeaderboard())
+    board.load([{**entry, "version": 1} for entry in ENTRIES])
+
+    with board.loading():
+        # committed before the snapshot was read: already in the snapshot
+        board.apply_balances({2: (350, 2)})
+        # committed after the snapshot was read
+        board.apply_balances({3: (900, 2)})
+        snapshot = [
+            {**entry, "balance": 350, "version": 2} if entry["user_id"] == 2
+            else {**entry, "version": 1}
+            for entry in ENTRIES
+        ]
+        board.load(snapshot)
+
+    assert [(e["username"], e["value"]) for e in board.top(limit=3)] == [
+        ("pam", 900), ("dwight", 500), ("jim", 350)
+    ]
+
+
+def test_leaderboard_refresh_seconds():
+    board = Leaderboard(FakeBackend(), refresh_seconds=60)
+    board.load(ENTRIES)
+    assert not board.stale
+    board.loaded_at -= 61
+    assert board.stale
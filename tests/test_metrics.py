@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+SCRIPT = """
+from dundie import metrics
+metrics.TRANSACTION_POINTS.inc({points})
+metrics.HTTP_IN_FLIGHT.inc()
+metrics.observe_request("GET", "/user/", 200, 0.01)
+"""
+
+
+def run(code, env):
+    return subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_metrics_are_summed_across_processes(tmp_path):
+    """Worker processes write to PROMETHEUS_MULTIPROC_DIR, /metrics sums them"""
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for points in (3, 4):
+        run(SCRIPT.format(points=points), env)
+
+    output = run("from dundie import metrics; print(metrics.render()[0].decode())", env)
+    assert "dundie_transaction_points_total 7.0" in output
+    assert 'dundie_http_requests_total{method="GET",route="/user/",status="200"} 2.0' in output
+    assert "dundie_http_requests_in_flight 2.0" in output
+
+    # a worker shutting down drops its share of the live gauges
+    code = "from dundie import metrics; metrics.HTTP_IN_FLIGHT.inc(); metrics.mark_process_dead()"
+    run(code, env)
+    output = run("from dundie import metrics; print(metrics.render()[0].decode())", env)
+    assert "dundie_http_requests_in_flight 2.0" in output
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from sqlalchemy import create_engine, inspect, text
+
+ROOT = Path(__file__).parent.parent
+
+
+def alembic(uri, *args):
+    """Runs alembic on `uri` in a new process (env.py builds the engine from settings)"""
+    env = {**os.environ, "DUNDIE_DB__uri": uri}
+    subprocess.run(
+        [sys.executable, "-m", "alembic", *args],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def test_migrations_upgrade_from_empty_database(tmp_path):
+    """The whole chain runs on an empty database and creates every model table"""
+    from dundie.models import SQLModel
+
+    uri = f"sqlite:///{tmp_path / 'migrations.db'}"
+    alembic(uri, "upgrade", "head")
+
+    engine = create_engine(uri)
+    tables = set(inspect(engine).get_table_names()) - {"alembic_version"}
+    assert tables == set(SQLModel.metadata.tables)
+    with engine.connect() as conn:
+        admin = conn.execute(text("SELECT dept, version FROM user WHERE username = 'admin'"))
+        assert admin.one() == ("management", 1)
+    engine.dispose()
+
+    alembic(uri, "downgrade", "base")
+
+
+def test_ledger_summary_migration_backfills_existing_transactions(tmp_path):
+    """5e8d0c6a1f92 summarizes the ledger as it was, before the archive table existed"""
+    uri = f"sqlite:///{tmp_path / 'migrations.db'}"
+    alembic(uri, "upgrade", "9c1f3a2b7d4e")
+
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO user (id, name, username, email, dept, password, currency) "
+            "VALUES (2, 'User', 'user', 'user@dm.com', 'sales', 'x', 'USD')"
+        ))
+        conn.execute(text(
+            'INSERT INTO "transaction" (user_id, from_id, value, date) VALUES '
+            "(2, 1, 10, '2026-01-01 10:00:00'), (2, 1, 5, '2026-01-01 18:00:00'), "
+            "(1, 2, 3, '2026-01-02 09:00:00')"
+        ))
+
+    alembic(uri, "upgrade", "head")
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT user_id, day, direction, value, transactions FROM ledgersummary "
+            "ORDER BY day, user_id, direction"
+        )).all()
+    engine.dispose()
+    assert rows == [
+        (1, "2026-01-01", "expense", 15, 2),
+        (2, "2026-01-01", "income", 15, 2),
+        (1, "2026-01-02", "income", 3, 1),
+        (2, "2026-01-02", "expense", 3, 1),
+    ]
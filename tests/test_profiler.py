@@ -0,0 +1,36 @@
+import time
+
+from dundie.profiler import SamplingProfiler
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler_collapsed_and_speedscope():
+    """Stacks of the busy thread are sampled root first"""
+    profiler = SamplingProfiler(interval=0.001).start()
+    busy_loop(0.2)
+    profiler.stop()
+
+    line = next(line for line in profiler.collapsed().splitlines() if "busy_loop" in line)
+    stack, count = line.rsplit(" ", 1)
+    assert stack.startswith("MainThread;")
+    assert stack.split(";")[-1].startswith("busy_loop (")
+    assert int(count) > 0
+
+    profile = profiler.speedscope()
+    frames = profile["shared"]["frames"]
+    main = next(p for p in profile["profiles"] if p["name"] == "MainThread")
+    assert main["type"] == "sampled"
+    assert len(main["samples"]) == len(main["weights"])
+    assert any(frames[sample[-1]]["name"] == "busy_loop" for sample in main["samples"])
+
+
+def test_sampling_profiler_stops_after_seconds():
+    profiler = SamplingProfiler(interval=0.001).start(seconds=0.05)
+    time.sleep(0.3)
+    assert not profiler.running
+    assert 0.05 <= profiler.duration < 0.3
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from dundie.security import (
+    HashedPassword,
+    PasswordHasherBusy,
+    PasswordHasherPool,
+    get_password_hash_async,
+    verify_password,
+    verify_password_async,
+)
+
+
+def test_password_hash_and_verify_async():
+    """Awaitable wrappers hash and verify on the hasher pool"""
+
+    async def hash_and_verify():
+        hashed = await get_password_hash_async("s3cr3t")
+        return hashed, await verify_password_async("s3cr3t", hashed)
+
+    hashed, valid = asyncio.run(hash_and_verify())
+    assert isinstance(hashed, HashedPassword)
+    assert valid is True
+    assert verify_password("wrong", hashed) is False
+    # an already hashed value is not hashed twice
+    assert HashedPassword.validate(hashed) is hashed
+
+
+def test_password_hasher_pool_rejects_when_queue_is_full():
+    """Calls beyond workers + max_queue fail fast with PasswordHasherBusy"""
+    from prometheus_client import REGISTRY
+
+    def gauges():
+        return [
+            REGISTRY.get_sample_value(name) or 0
+            for name in (
+                "dundie_password_hasher_in_progress",
+                "dundie_password_hasher_queue_depth",
+                "dundie_password_hasher_rejected_total",
+            )
+        ]
+
+    pool = PasswordHasherPool(workers=1, max_queue=1)
+    in_progress, queued, rejected = gauges()
+
+    async def storm():
+        release = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def blocked():
+            asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+            return True
+
+        running = [asyncio.create_task(pool.run(blocked)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert pool.stats()["queue_depth"] == 1
+        with pytest.raises(PasswordHasherBusy):
+            await pool.run(blocked)
+        # exported to Prometheus too
+        assert gauges() == [in_progress + 1, queued + 1, rejected + 1]
+        release.set()
+        return await asyncio.gather(*running)
+
+    assert asyncio.run(storm()) == [True, True]
+    assert pool.stats() == {"workers": 1, "in_progress": 0, "queue_depth": 0, "rejected": 1}
+    assert gauges() == [in_progress, queued, rejected + 1]
+    pool.shutdown()
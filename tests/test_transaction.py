@@ -0,0 +1,240 @@
+from dundie.tasks.transaction import load_transaction_items
+
+
+def test_load_transaction_items(tmp_path):
+    """Batch files can be CSV with header or JSON lines"""
+    csv_file = tmp_path / "awards.csv"
+    csv_file.write_text("username,value\nuser1,10\nuser2,20\n")
+    jsonl_file = tmp_path / "awards.jsonl"
+    jsonl_file.write_text(
+        '{"username": "user1", "value": 10}\n\n{"username": "user2", "value": "20"}\n'
+    )
+
+    expected = [("user1", 10), ("user2", 20)]
+    assert load_transaction_items(csv_file) == expected
+    assert load_transaction_items(jsonl_file) == expected
+
+
+def test_load_transaction_items_lists_malformed_rows(tmp_path):
+    """Every malformed row is reported with its file line, none is loaded"""
+    import pytest
+
+    from dundie.tasks.transaction import TransactionBatchError
+
+    jsonl_file = tmp_path / "awards.jsonl"
+    jsonl_file.write_text(
+        '{"username": "user1", "value": 10}\n\n{"username": "user2", "value": 1.5x}\n'
+        '{"value": 3}\n{"username": "user4", "value": "3 points"}\n'
+    )
+    with pytest.raises(TransactionBatchError) as error:
+        load_transaction_items(jsonl_file)
+    assert [(e["index"], e["error"].split(":")[0]) for e in error.value.errors] == [
+        (1, "line 3"),
+        (2, "line 4"),
+        (3, "line 5"),
+    ]
+    assert error.value.errors[2]["error"] == "line 5: value '3 points' is not an integer"
+
+
+def test_concurrent_transfers_never_overspend():
+    """Many threads draining the same sender can't take more than its balance"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sqlalchemy.exc import IntegrityError
+    from sqlmodel import Session, select
+
+    from dundie.cli import create_user
+    from dundie.db import engine
+    from dundie.models import User
+    from dundie.tasks.transaction import TransactionError, add_transaction, reconcile_balances
+
+    for username in ("stress-sender", "stress-receiver"):
+        try:
+            create_user(name=username, email=f"{username}@dm.com", password=username, dept="sales")
+        except IntegrityError:
+            pass
+
+    def get_user(session, username):
+        return session.exec(select(User).where(User.username == username)).one()
+
+    with Session(engine) as session:
+        sender = get_user(session, "stress-sender")
+        add_transaction(
+            user=sender, from_user=get_user(session, "admin"), value=50, session=session
+        )
+        start_sender, start_receiver = sender.balance, get_user(session, "stress-receiver").balance
+
+    def transfer(_):
+        with Session(engine) as session:
+            try:
+                add_transaction(
+                    user=get_user(session, "stress-receiver"),
+                    from_user=get_user(session, "stress-sender"),
+                    value=1,
+                    session=session,
+                )
+                return True
+            except TransactionError:
+                return False
+
+    attempts = start_sender + 30
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(transfer, range(attempts)))
+
+    with Session(engine) as session:
+        assert sum(results) == start_sender
+        assert get_user(session, "stress-sender").balance == 0
+        assert get_user(session, "stress-receiver").balance == start_receiver + start_sender
+        assert reconcile_balances(session) == []
+
+
+def test_ledger_summary_rebuild_matches_incremental_updates():
+    """Rebuilding the summary from the ledger gives the incremental rows back"""
+    from sqlmodel import Session, select
+
+    from dundie.db import engine
+    from dundie.models import LedgerSummary
+    from dundie.tasks.transaction import rebuild_ledger_summary
+
+    def snapshot(session):
+        rows = session.exec(select(LedgerSummary)).all()
+        return {(r.user_id, str(r.day), r.direction): (r.value, r.transactions) for r in rows}
+
+    with Session(engine) as session:
+        incremental = snapshot(session)
+        assert incremental
+        assert rebuild_ledger_summary(session) == len(incremental)
+        assert snapshot(session) == incremental
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_only_transient_errors_are_retried(monkeypatch):
+    """Insert races are retried, other integrity errors (FK, NOT NULL) fail at once"""
+    import pytest
+    from sqlalchemy import Column, Integer, MetaData, Table, create_engine
+    from sqlalchemy.exc import IntegrityError
+    from sqlmodel import Session
+
+    from dundie.tasks import transaction
+    from dundie.tasks.transaction import TransientTransactionError, _commit_with_retry
+
+    monkeypatch.setattr(transaction.time, "sleep", lambda seconds: None)
+    table = Table("race", MetaData(), Column("id", Integer, primary_key=True),
+                  Column("value", Integer, nullable=False))
+    engine = create_engine("sqlite://")
+    table.metadata.create_all(engine)
+    with Session(engine) as session:
+        transaction._insert_missing(session, table, [{"id": 1, "value": 0}])
+        with pytest.raises(TransientTransactionError):
+            transaction._insert_missing(session, table, [{"id": 1, "value": 0}])
+        session.rollback()
+        with pytest.raises(IntegrityError):
+            transaction._insert_missing(session, table, [{"id": 2, "value": None}])
+
+    calls = []
+
+    def race():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TransientTransactionError("balance inserted first")
+        return "posted"
+
+    session = FakeSession()
+    assert _commit_with_retry(session, race) == "posted"
+    assert (len(calls), session.rollbacks, session.commits) == (3, 2, 1)
+
+    def not_null():
+        calls.append(1)
+        raise IntegrityError("INSERT", {}, Exception("NOT NULL constraint failed"))
+
+    calls.clear()
+    with pytest.raises(IntegrityError):
+        _commit_with_retry(FakeSession(), not_null)
+    assert len(calls) == 1
+
+    def always_race():
+        raise TransientTransactionError("again")
+
+    # retries=0: the caller (run_transaction_async) retries
+    with pytest.raises(TransientTransactionError):
+        _commit_with_retry(FakeSession(), always_race, retries=0)
+
+
+def test_asyncpg_deadlocks_are_retried(monkeypatch):
+    """asyncpg raises deadlocks as a plain DBAPIError, the SQLSTATE decides"""
+    import pytest
+    from sqlalchemy.exc import DBAPIError
+
+    from dundie.tasks import transaction
+    from dundie.tasks.transaction import TransientTransactionError, _commit_with_retry
+
+    monkeypatch.setattr(transaction.time, "sleep", lambda seconds: None)
+
+    class AsyncpgError(Exception):
+        """Like the asyncpg adapter errors SQLAlchemy wraps"""
+
+        def __init__(self, message, sqlstate):
+            super().__init__(message)
+            self.pgcode = self.sqlstate = sqlstate
+
+    calls = []
+
+    def deadlock():
+        calls.append(1)
+        if len(calls) < 2:
+            raise DBAPIError("UPDATE balance", {}, AsyncpgError("deadlock detected", "40P01"))
+        return "posted"
+
+    session = FakeSession()
+    assert _commit_with_retry(session, deadlock) == "posted"
+    assert (len(calls), session.rollbacks, session.commits) == (2, 1, 1)
+
+    def serialization_failure():
+        raise DBAPIError("UPDATE balance", {}, AsyncpgError("could not serialize", "40001"))
+
+    # retries=0 hands it to run_transaction_async as a TransientTransactionError
+    with pytest.raises(TransientTransactionError):
+        _commit_with_retry(FakeSession(), serialization_failure, retries=0)
+
+    def syntax_error():
+        raise DBAPIError("SELEC", {}, AsyncpgError("syntax error", "42601"))
+
+    with pytest.raises(DBAPIError):
+        _commit_with_retry(FakeSession(), syntax_error)
+
+
+def test_async_retries_never_sleep_on_the_event_loop(monkeypatch):
+    """run_transaction_async awaits the backoff between run_sync attempts"""
+    import asyncio
+
+    from dundie.tasks import transaction
+    from dundie.tasks.transaction import TransientTransactionError, run_transaction_async
+
+    def blocking_sleep(seconds):
+        raise AssertionError("time.sleep on the event loop")
+
+    monkeypatch.setattr(transaction.time, "sleep", blocking_sleep)
+    attempts = []
+
+    class AsyncSession:
+        async def run_sync(self, func):
+            return func(None)
+
+    def func(sync_session):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise TransientTransactionError("deadlock")
+        return "committed"
+
+    assert asyncio.run(run_transaction_async(AsyncSession(), func)) == "committed"
+    assert len(attempts) == 3